@@ -0,0 +1,224 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# test_run.py と同じルートのASGIアプリケーション(AsyncPapero使用)
+#   uvicorn asgi_app:app
+#   hypercorn asgi_app:app
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import os
+import json
+import urllib.parse
+
+import papero_pool
+import papero_metrics
+import papero_lum
+
+import operation
+
+DEFAULT_SIMULATOR_ID = "iwl2kro4"
+
+# PAPERO_WSSVR でWebSocket接続先を変更できる(ベンチマーク用モックサーバ等)
+pool = papero_pool.AsyncPaperoPool(ws_server_addr=os.environ.get("PAPERO_WSSVR", ""))
+lum_samplers = papero_lum.LumSamplers(pool, papero_lum.AsyncLumSampler)
+
+
+class Request:
+    """
+    HTTPリクエスト(ASGIのscopeと本文)
+    """
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {k: v[0] for k, v in urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.body = body
+
+    def get_json(self):
+        """
+        @return 本文のJSON(JSONでなければNone)
+        """
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+def robot_key(request):
+    """
+    リクエストで指定されたシミュレータID・ロボット名(sim/robot)
+    """
+    params = request.get_json()
+    if not isinstance(params, dict):
+        params = {}
+    simulator_id = params.get("sim") or request.args.get("sim", DEFAULT_SIMULATOR_ID)
+    robot_name = params.get("robot") or request.args.get("robot", "")
+    return simulator_id, robot_name
+
+
+def jsonify(obj, status=200):
+    return status, json.dumps(obj), "application/json"
+
+
+def end_session(request, result):
+    """
+    bye・終了処理をバックグラウンドで開始し、終了処理ハンドルを返す
+    """
+    handle = pool.end(*robot_key(request), before=operation.bye_async)
+    if handle is None:
+        return jsonify({"result": result, "teardown": None})
+    return jsonify({"result": result, "teardown": handle.to_dict()}, 202)
+
+
+async def play(request, name):
+    gesture = operation.GESTURES[name]
+    async with pool.session(*robot_key(request)) as papero:
+        gesture.play(papero)
+    return 200, gesture.reply, "text/html; charset=utf-8"
+
+
+async def metrics(request):
+    sessions = [((("simulator", key[0]), ("robot", key[1])), papero) for key, papero in pool.sessions()]
+    return 200, papero_metrics.render_prometheus(sessions), "text/plain; version=0.0.4"
+
+
+async def lum(request):
+    """
+    照度(キャッシュした値、max_age=秒数を指定するとそれより古ければ取得を待つ)
+    """
+    try:
+        max_age = float(request.args["max_age"]) if "max_age" in request.args else None
+    except ValueError:
+        max_age = None
+    reading = await lum_samplers.get(robot_key(request)).read(max_age)
+    if reading is None:
+        return 504, "luminance not available", "text/plain"
+    return jsonify(reading.to_dict())
+
+
+async def start(request):
+    return await play(request, "hello")
+
+
+async def ok(request):
+    return await play(request, "ok")
+
+
+async def thank(request):
+    return await play(request, "thank")
+
+
+async def end(request):
+    return end_session(request, "end")
+
+
+async def teardown(request, handle_id):
+    """
+    終了処理の状態取得(wait=秒数を指定すると完了まで待つ)
+    """
+    handle = pool.teardown.get(handle_id)
+    if handle is None:
+        return 404, "unknown teardown", "text/plain"
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        wait = 0.0
+    if wait:
+        await handle.wait_async(min(wait, 30.0))
+    return jsonify(handle.to_dict())
+
+
+async def test(request):
+    if request.method == "GET":
+        return 200, "aaa\n        ", "text/html; charset=utf-8"
+    post_data = request.get_json()
+    if not isinstance(post_data, dict) or ("work" not in post_data):
+        return 400, "bad request", "text/plain"
+    if post_data["work"] == "bye":
+        return end_session(request, "bye")
+    if post_data["work"] not in operation.GESTURES:
+        return 400, "unknown work", "text/plain"
+    return await play(request, post_data["work"])
+
+
+ROUTES = {
+    "/metrics": (("GET",), metrics),
+    "/lum": (("GET",), lum),
+    "/start": (("GET",), start),
+    "/ok": (("GET",), ok),
+    "/thank": (("GET",), thank),
+    "/end": (("GET",), end),
+    "/": (("GET", "POST"), test),
+}
+
+
+async def dispatch(request):
+    """
+    @return (ステータス, 本文, Content-Type)
+    """
+    route = ROUTES.get(request.path)
+    if route is not None:
+        methods, handler = route
+        if request.method not in methods:
+            return 405, "method not allowed", "text/plain"
+        return await handler(request)
+    if request.path.startswith("/teardown/") and (request.method == "GET"):
+        return await teardown(request, request.path[len("/teardown/"):])
+    return 404, "not found", "text/plain"
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await pool.close_all()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGIアプリケーション
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    request = Request(scope, await read_body(receive))
+    headers = [(b"access-control-allow-origin", b"*")]
+    if request.method == "OPTIONS":
+        status, body, content_type = 200, "", "text/plain"
+        headers.append((b"access-control-allow-methods", b"GET, POST, OPTIONS"))
+        headers.append((b"access-control-allow-headers", b"Content-Type"))
+    else:
+        try:
+            status, body, content_type = await dispatch(request)
+        except papero_pool.PaperoPoolFull:
+            status, body, content_type = 503, "too many robot sessions", "text/plain"
+        except ConnectionError:
+            status, body, content_type = 502, "robot connection failed", "text/plain"
+        except Exception:
+            logger.exception("------Error occurred(app()). Path : " + request.path)
+            status, body, content_type = 500, "internal server error", "text/plain"
+    body = body.encode("utf-8")
+    headers.append((b"content-type", content_type.encode("latin-1")))
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
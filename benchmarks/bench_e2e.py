@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# モックサーバを使った End-to-End ベンチマーク
+#   python -m benchmarks.bench_e2e [--latency 0.005] [-n 200]
+# 接続時間、コマンド送信スループット、send_*系統ごと及び
+# Flaskルートごとの p50/p99 レイテンシを出力する
+##############################################################
+import sys
+import time
+import argparse
+
+import pypapero
+from benchmarks.mock_server import MockPaperoServer
+
+
+P = pypapero.Papero
+
+# (表示名, 送信関数, 引数)
+SEND_FAMILIES = [
+    ("moveHead", P.send_move_head, (["A-15T500L", "A0T500L"], ["A0T500L", "R0T500L"])),
+    ("turnLedOn", P.send_turn_led_on, ("mouth", ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2"])),
+    ("startSpeech", P.send_start_speech, ("こんにちは",)),
+    ("getHeadStatus", P.send_get_head_status, ()),
+    ("getLedStatus", P.send_get_led_status, ("mouth",)),
+    ("getSensorValue", P.send_get_sensor_value, ()),
+    ("getLumSensorValue", P.send_get_lum_sensor_value, ()),
+    ("startMotion", P.send_start_motion, (1,)),
+]
+
+# (表示名, メソッド, パス, JSON)
+FLASK_ROUTES = [
+    ("GET /start", "get", "/start", None),
+    ("GET /ok", "get", "/ok", None),
+    ("GET /thank", "get", "/thank", None),
+    ("POST / hello", "post", "/", {"work": "hello"}),
+    ("POST / sorry", "post", "/", {"work": "sorry"}),
+]
+
+
+def percentile(samples, p):
+    """
+    @param samples:ソート済みのリスト
+    @param p:0～100
+    """
+    if len(samples) == 0:
+        return float("nan")
+    i = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+    return samples[i]
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print("%-24s %8d %10.3f %10.3f %10.3f" % (
+        name, len(samples), percentile(samples, 50) * 1e3, percentile(samples, 99) * 1e3,
+        max(samples) * 1e3))
+
+
+def bench_connect(url, n):
+    samples = []
+    for i in range(n):
+        st = time.perf_counter()
+        papero = pypapero.Papero("bench", "", url)
+        samples.append(time.perf_counter() - st)
+        papero.papero_cleanup()
+    report("connect", samples)
+
+
+def bench_throughput(papero, n):
+    st = time.perf_counter()
+    message_ids = [papero.send_get_head_status() for i in range(n)]
+    for message_id in message_ids:
+        papero.papero_wait_response(message_id, 10.0)
+    elapsed = time.perf_counter() - st
+    print("%-24s %8d %10.1f commands/sec" % ("throughput", n, n / elapsed))
+
+
+def bench_send_families(papero, n):
+    for name, func, args in SEND_FAMILIES:
+        samples = []
+        for i in range(n):
+            st = time.perf_counter()
+            message_id = func(papero, *args)
+            papero.papero_wait_response(message_id, 10.0)
+            samples.append(time.perf_counter() - st)
+        report(name, samples)
+
+
+def bench_flask_routes(url, n):
+    import test_run
+    test_run.pool.ws_server_addr = url
+    client = test_run.app.test_client()
+    client.get("/start")  # 接続を確立しておく
+    for name, method, path, data in FLASK_ROUTES:
+        samples = []
+        for i in range(n):
+            st = time.perf_counter()
+            getattr(client, method)(path, json=data)
+            samples.append(time.perf_counter() - st)
+        report(name, samples)
+    samples = []
+    for i in range(n):
+        client.get("/start")
+        st = time.perf_counter()
+        client.get("/end")
+        samples.append(time.perf_counter() - st)
+    report("GET /end", samples)
+    test_run.pool.close_all()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="end-to-end benchmarks against a mock PaPeRo server")
+    parser.add_argument("--latency", type=float, default=0.005, help="mock reply latency in seconds")
+    parser.add_argument("-n", "--number", type=int, default=200, help="samples per measurement")
+    parser.add_argument("--no-flask", action="store_true", help="skip Flask route benchmarks")
+    args = parser.parse_args(argv[1:])
+    server = MockPaperoServer(latency=args.latency).start()
+    print("mock server %s latency=%.1fms" % (server.url, args.latency * 1e3))
+    print("%-24s %8s %10s %10s %10s" % ("benchmark", "n", "p50 ms", "p99 ms", "max ms"))
+    bench_connect(server.url, max(1, args.number // 10))
+    papero = pypapero.Papero("bench", "", server.url)
+    bench_send_families(papero, args.number)
+    bench_throughput(papero, args.number * 10)
+    papero.papero_cleanup()
+    if not args.no_flask:
+        bench_flask_routes(server.url, args.number)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# コマンド組み立て・エンコードのマイクロベンチマーク
+#   python -m benchmarks.bench_encode [-n 回数]
+##############################################################
+import sys
+import json
+import time
+import math
+import timeit
+import argparse
+
+import pypapero
+
+
+PATTERN = ["NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2",
+           "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2"]
+
+
+def legacy_get_now_time_for_robot_message():
+    """
+    Ver.1.01の時刻文字列組み立て(比較用)
+    """
+    t = time.localtime()
+    str_yyyy = str(t.tm_year)
+    str_mth = ("0" + str(t.tm_mon))[-2:]
+    str_day = ("0" + str(t.tm_mday))[-2:]
+    str_hh = ("0" + str(t.tm_hour))[-2:]
+    str_mm = ("0" + str(t.tm_min))[-2:]
+    str_ss = ("0" + str(t.tm_sec))[-2:]
+    return str_yyyy + "-" + str_mth + "-" + str_day + " " + str_hh + ":" + str_mm + ":" + str_ss
+
+
+def legacy_build_seq_str(list_seq, n_limit):
+    """
+    Ver.1.01のシーケンス文字列組み立て(比較用)
+    """
+    n = min(len(list_seq), n_limit)
+    rtn_str = ""
+    for i in range(n):
+        if rtn_str != "":
+            rtn_str += ","
+        rtn_str += list_seq[i]
+    return rtn_str
+
+
+def legacy_turn_led_on(message_id):
+    """
+    Ver.1.01のturnLedOn組み立て・送信伝文エンコード(比較用)
+    """
+    msg_dic_snd = {}
+    msg_dic_snd["Name"] = "turnLedOn"
+    msg_dic_snd["Type"] = "Command"
+    msg_dic_snd["Destination"] = "LEDController"
+    msg_dic_snd["Source"] = "Script"
+    msg_dic_snd["Time"] = legacy_get_now_time_for_robot_message()
+    msg_dic_snd["Priority"] = "normal"
+    msg_dic_snd["MessageID"] = str(message_id)
+    msg_dic_snd["Part"] = "mouth"
+    msg_dic_snd["Sequence"] = str(min(math.floor(len(PATTERN) / 2), 26))
+    msg_dic_snd["Repeat"] = "false"
+    msg_dic_snd["Pattern"] = legacy_build_seq_str(PATTERN, 26 * 2)
+    return json.dumps({"Name": "RobotMessage", "RobotID": 1, "Messages": [msg_dic_snd]})
+
+
+def current_turn_led_on(message_id):
+    """
+    現行のturnLedOn組み立て・送信伝文エンコード
+    """
+    recorder = pypapero.CommandRecorder()
+    recorder.messageID = message_id
+    pypapero.Papero.send_turn_led_on(recorder, "mouth", PATTERN)
+    return '{"Name": "RobotMessage", "RobotID": 1, "Messages": [' \
+        + pypapero.encode_robot_message(recorder.messages[0]) + ']}'
+
+
+LED_TEMPLATE = pypapero.compile_command(pypapero.Papero.send_turn_led_on, "mouth", PATTERN)
+
+
+def template_turn_led_on(message_id):
+    """
+    コンパイル済みturnLedOnの送信伝文エンコード
+    """
+    message = LED_TEMPLATE.render(str(message_id), pypapero.get_now_time_for_robot_message())
+    return '{"Name": "RobotMessage", "RobotID": 1, "Messages": [' + message.encoded + ']}'
+
+
+BENCHMARKS = [
+    ("get_now_time_for_robot_message (legacy)", legacy_get_now_time_for_robot_message),
+    ("get_now_time_for_robot_message", pypapero.get_now_time_for_robot_message),
+    ("build_seq_str (legacy)", lambda: legacy_build_seq_str(PATTERN, 52)),
+    ("build_seq_str", lambda: pypapero.build_seq_str(PATTERN, 52)),
+    ("set_common_for_command", lambda: pypapero.set_common_for_command({}, "turnLedOn", "LEDController")),
+    ("json_dumps(command)", lambda: pypapero.json_dumps(LED_TEMPLATE.fields)),
+    ("turnLedOn frame (legacy)", lambda: legacy_turn_led_on(1)),
+    ("turnLedOn frame", lambda: current_turn_led_on(1)),
+    ("turnLedOn frame (template)", lambda: template_turn_led_on(1)),
+]
+
+
+def run(number, backends):
+    print("%-44s %-8s %12s" % ("benchmark", "json", "usec/call"))
+    for backend in backends:
+        pypapero.set_json_backend(backend)
+        for name, func in BENCHMARKS:
+            sec = min(timeit.repeat(func, number=number, repeat=3))
+            print("%-44s %-8s %12.3f" % (name, backend, sec / number * 1e6))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="pypapero encoder microbenchmarks")
+    parser.add_argument("-n", "--number", type=int, default=20000, help="calls per measurement")
+    args = parser.parse_args(argv[1:])
+    backends = ["json"]
+    if pypapero.orjson is not None:
+        backends.append("orjson")
+    run(args.number, backends)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
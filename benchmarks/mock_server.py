@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# ベンチマーク用の PaPeRo WebSocketサーバ(モック)
+#   python -m benchmarks.mock_server [--port 8765] [--latency 0.005]
+# SelectSimRobot には Ready を、RobotMessage の各コマンドには
+# latency 秒後に <Name>Res を返す
+##############################################################
+import sys
+import json
+import asyncio
+import argparse
+import threading
+
+import tornado.web
+import tornado.ioloop
+import tornado.websocket
+
+
+class MockPaperoHandler(tornado.websocket.WebSocketHandler):
+    """
+    1接続分の処理
+    """
+
+    def initialize(self, server):
+        self.server = server
+
+    def check_origin(self, origin):
+        return True
+
+    def on_message(self, message):
+        msg_dic_rcv = json.loads(message)
+        name = msg_dic_rcv.get("Name")
+        self.server.frames_received += 1
+        if name == "SelectSimRobot":
+            self.server.robot_count += 1
+            self.write_message(json.dumps({"Name": "Ready", "RobotID": self.server.robot_count}))
+        elif name == "RobotMessage":
+            for msg in msg_dic_rcv.get("Messages", []):
+                self.server.commands_received += 1
+                tornado.ioloop.IOLoop.current().call_later(self.server.latency, self.reply, msg)
+
+    def reply(self, msg):
+        res = {"Name": msg["Name"] + "Res",
+               "Type": "Response",
+               "Destination": "Script",
+               "Source": msg.get("Destination", ""),
+               "MessageID": msg.get("MessageID", ""),
+               "Result": "OK"}
+        try:
+            self.write_message(json.dumps({"Name": "RobotMessage", "Messages": [res]}))
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+
+class MockPaperoServer:
+    """
+    別スレッドのイベントループで動くモックサーバ
+        server = MockPaperoServer(latency=0.005).start()
+        papero = pypapero.Papero("sim", "", server.url)
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        """
+        @param port:待ち受けポート(0なら空きポート)
+        @param latency:応答を返すまでの秒数
+        """
+        self.port = port
+        self.latency = latency
+        self.robot_count = 0
+        self.frames_received = 0
+        self.commands_received = 0
+        self.loop = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "ws://127.0.0.1:%d/papero" % self.port
+
+    def make_app(self):
+        return tornado.web.Application([(r"/papero", MockPaperoHandler, {"server": self})])
+
+    def start(self):
+        """
+        サーバスレッド開始(待ち受け開始まで待つ)
+        """
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            http_server = self.make_app().listen(self.port, "127.0.0.1")
+            if self.port == 0:
+                sock = next(iter(http_server._sockets.values()))
+                self.port = sock.getsockname()[1]
+            self.loop = tornado.ioloop.IOLoop.current()
+            started.set()
+            self.loop.start()
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.add_callback(self.loop.stop)
+            self.thread.join(5.0)
+            self.loop = None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="mock PaPeRo websocket server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.005, help="reply latency in seconds")
+    args = parser.parse_args(argv[1:])
+    server = MockPaperoServer(args.port, args.latency)
+    server.make_app().listen(args.port)
+    print("listening on " + server.url)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
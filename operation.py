@@ -1,50 +1,115 @@
 import sys
 
+import pypapero
+import papero_timeline
+
+P = pypapero.Papero
+
+
+class Gesture:
+    """
+    起動時に一度だけコンパイルしたジェスチャー
+    (送信時はMessageID・Timeのみ埋め込む)
+    """
+
+    def __init__(self, name, reply, commands):
+        """
+        @param name:ジェスチャー名(POST / の work)
+        @param reply:応答文字列
+        @param commands:(Papero.send_*関数, 引数...)のリスト
+        """
+        self.name = name
+        self.reply = reply
+        self.templates = [pypapero.compile_command(command[0], *command[1:]) for command in commands]
+        # 動作時間(秒)。TimelinePlayerで続けて再生できるようcuesも持つ
+        self.duration = max([papero_timeline.message_duration(t.fields) for t in self.templates] + [0.0])
+        self.cues = [(0.0, self.templates)]
+
+    def play(self, papero):
+        """
+        ジェスチャー実行(全コマンドを1伝文で送信)
+        @return messageIDのリスト
+        """
+        if papero.errOccurred != 0:
+            return []
+        with papero.batch():
+            return [papero.send_command_template(template) for template in self.templates]
+
+
+GESTURES = {}
+
+
+def register_gesture(name, reply, commands):
+    """
+    ジェスチャー登録
+    """
+    GESTURES[name] = Gesture(name, reply, commands)
+    return GESTURES[name]
+
+
+register_gesture("hello", "start", [
+    (P.send_move_head, ["A-15T500L", "A0T500L"],
+                       ["A0T500L", "R0T500L"]),
+    (P.send_turn_led_on, "mouth",
+                         ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"]),
+    (P.send_start_speech, "こんにちは"),
+])
+
+register_gesture("ok", "ok", [
+    (P.send_move_head, ["A-15T200L", "A15T500L", "A-15T500L", "A15T500L", "A0T300L"],
+                       ["A0T200L", "R0T1800L"]),
+    (P.send_turn_led_on, "mouth",
+                         ["NNNG3G3G3NNN", "2", "G3NG3NG3NG3NG3", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"]),
+    (P.send_start_speech, " りょうかいしました"),
+])
+
+register_gesture("sorry", "sorry", [
+    (P.send_move_head, ["A-15T600L", "A-5T400L", "A-10T400L", "A-5T300L", "A-15T800L"],
+                       ["A0T600L", "R0T1900L"]),
+    (P.send_turn_led_on, "mouth",
+                         ["NNNG3G3G3NNN", "2", "NNG3G3G3G3G3NN", "2", "NNG3NG3NG3NN", "2", "NG3G3G3G3G3G3G3N", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2"]),
+    (P.send_start_speech, "ごめんなさい"),
+])
+
+register_gesture("thank", "thank", [
+    (P.send_turn_led_on, "cheek",
+                         ["R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2"]),
+    (P.send_turn_led_on, "mouth",
+                         ["NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "NNNG3G3G3NNN", "2"]),
+    (P.send_start_speech, "ありがとうございます"),
+])
+
+register_gesture("bye", "bye", [
+    (P.send_move_head, ["A-15T500L", "A0T500L"],
+                       ["A0T500L", "R0T500L"]),
+    (P.send_turn_led_on, "mouth",
+                         ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"]),
+    (P.send_start_speech, "さようなら"),
+])
+
 
 def hello(papero):
-    if papero.errOccurred == 0:
-        papero.send_move_head(["A-15T500L", "A0T500L"],
-                              ["A0T500L", "R0T500L"])
-        papero.send_turn_led_on("mouth",
-                                ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"])
-        papero.send_start_speech("こんにちは")
+    GESTURES["hello"].play(papero)
 
 
 def ok(papero):
-    if papero.errOccurred == 0:
-        papero.send_move_head(["A-15T200L", "A15T500L", "A-15T500L", "A15T500L", "A0T300L"],
-                              ["A0T200L", "R0T1800L"])
-        papero.send_turn_led_on("mouth",
-                                ["NNNG3G3G3NNN", "2", "G3NG3NG3NG3NG3", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"])
-        papero.send_start_speech(" りょうかいしました")
+    GESTURES["ok"].play(papero)
 
 def sorry(papero):
-    papero.send_move_head(["A-15T600L", "A-5T400L", "A-10T400L", "A-5T300L", "A-15T800L"],
-                          ["A0T600L", "R0T1900L"])
-    papero.send_turn_led_on("mouth",
-                            ["NNNG3G3G3NNN", "2", "NNG3G3G3G3G3NN", "2", "NNG3NG3NG3NN", "2", "NG3G3G3G3G3G3G3N", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2"])
-    papero.send_start_speech("ごめんなさい")
+    GESTURES["sorry"].play(papero)
 
 def thank(papero):
-    papero.send_turn_led_on("cheek",
-                            ["R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2", "R3R3", "2"])
-    papero.send_turn_led_on("mouth",
-                            ["NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NNNG3G3G3NNN", "2", "NG3G3G3G3G3G3G3N", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2", "NNNG3G3G3NNN", "2"])
-    papero.send_start_speech("ありがとうございます")
+    GESTURES["thank"].play(papero)
 
 #実行の終了
 def bye(papero):
-    if papero.errOccurred == 0:
-        papero.send_move_head(["A-15T500L", "A0T500L"],
-                              ["A0T500L", "R0T500L"])
-        papero.send_turn_led_on("mouth",
-                                ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2", "G3NG3NG3NG3NG3", "2", "G3NG3NG3NG3NG3", "2", "NG3G3G3G3G3G3G3N", "2"])
-        papero.send_start_speech("さようなら")
-        cnt = 0
-        while cnt < 3:
-            messages = papero.papero_robot_message_recv(1.0)
-            if messages is not None:
-                cnt += 1
+    for message_id in GESTURES["bye"].play(papero):
+        papero.papero_wait_response(message_id, 1.0)
+
+#実行の終了(AsyncPapero用)
+async def bye_async(papero):
+    for message_id in GESTURES["bye"].play(papero):
+        await papero.papero_wait_response(message_id, 1.0)
 
 
 
@@ -0,0 +1,270 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 加速度センサのリングバッファ・揺れ検出
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import time
+import threading
+
+import numpy
+
+import papero_face
+
+# 加速度データの伝文名と項目名
+ACC_EVENT = "accSensorData"
+ACC_FIELDS = ("X", "Y", "Z")
+# setAccSensorのDataRate→Hz
+DATA_RATES = {2: 10.0, 3: 25.0, 4: 50.0, 5: 100.0, 9: 1344.0}
+
+
+class AccRing:
+    """
+    加速度サンプルの固定長リングバッファ(古いものから上書き)
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.samples = numpy.zeros((capacity, 3), dtype=numpy.float32)
+        self.times = numpy.zeros(capacity, dtype=numpy.float64)
+        self.head = 0  # 次に書き込む位置
+        self.count = 0
+        self.total = 0  # 書き込んだサンプルの累計
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, times, samples):
+        """
+        @param times:時刻(秒)の配列
+        @param samples:(件数, 3)の配列
+        """
+        n = len(times)
+        if n > self.capacity:
+            times = times[-self.capacity:]
+            samples = samples[-self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        first = min(n, self.capacity - self.head)
+        self.times[self.head:self.head + first] = times[:first]
+        self.samples[self.head:self.head + first] = samples[:first]
+        if first < n:
+            self.times[:n - first] = times[first:]
+            self.samples[:n - first] = samples[first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+        self.total += n
+
+    def latest(self, n=None):
+        """
+        @param n:件数(Noneなら全件)
+        @return (時刻, サンプル)のコピー(古い順)
+        """
+        if (n is None) or (n > self.count):
+            n = self.count
+        index = numpy.arange(self.head - n, self.head) % self.capacity
+        return self.times[index], self.samples[index]
+
+    def window(self, seconds, now=None):
+        """
+        @param seconds:さかのぼる秒数
+        @param now:基準時刻(Noneなら最新サンプルの時刻)
+        @return (時刻, サンプル)のコピー(古い順)
+        """
+        times, samples = self.latest()
+        if len(times) == 0:
+            return times, samples
+        if now is None:
+            now = times[-1]
+        i = numpy.searchsorted(times, now - seconds, side="left")
+        return times[i:], samples[i:]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+def dynamic_magnitude(samples):
+    """
+    重力(平均)を除いた加速度の大きさ
+    @param samples:(件数, 3)の配列
+    @return 件数の配列
+    """
+    if len(samples) == 0:
+        return numpy.zeros(0)
+    dynamic = samples - samples.mean(axis=0)
+    return numpy.sqrt(numpy.einsum("ij,ij->i", dynamic, dynamic))
+
+
+def motion_stats(times, samples):
+    """
+    @param times:時刻(秒)の配列
+    @param samples:(件数, 3)の配列
+    @return {"count":件数, "rms":実効値, "peak":最大値, "jerk":加加速度の最大値(1秒あたり)}
+    (rms・peakは重力を除いた大きさ、サンプルがなければ0.0)
+    """
+    rtn = {"count": len(times), "rms": 0.0, "peak": 0.0, "jerk": 0.0}
+    if len(times) == 0:
+        return rtn
+    magnitude = dynamic_magnitude(samples)
+    rtn["rms"] = float(numpy.sqrt(numpy.mean(magnitude * magnitude)))
+    rtn["peak"] = float(magnitude.max())
+    if len(times) >= 2:
+        dt = numpy.diff(times)
+        valid = dt > 0
+        if numpy.any(valid):
+            da = numpy.diff(samples, axis=0)[valid]
+            rtn["jerk"] = float((numpy.sqrt(numpy.einsum("ij,ij->i", da, da)) / dt[valid]).max())
+    return rtn
+
+
+class ShakeDetector:
+    """
+    クライアント側の揺れ検出(setAccSensorThresholdと同じ考え方)
+    ・揺れ開始:window秒以内に揺れ開始閾値(det_value)をfrequency回以上超えた
+    ・揺れ終了:揺れ終了閾値(los_value)を下回る状態がquiet秒続いた
+    """
+
+    def __init__(self, det_value, los_value, frequency=3, quiet=0.5, window=0.5, on_shake=None, on_calm=None):
+        """
+        @param det_value:揺れ開始閾値(重力を除いた加速度の大きさ)
+        @param los_value:揺れ終了閾値
+        @param frequency:揺れ開始閾値を超える回数
+        @param quiet:揺れ終了閾値を下回る期間(秒)
+        @param window:揺れ開始を判定する期間(秒)
+        @param on_shake:on_shake(時刻) 揺れ開始時に呼ぶ
+        @param on_calm:on_calm(時刻) 揺れ終了時に呼ぶ
+        """
+        self.det_value = det_value
+        self.los_value = los_value
+        self.frequency = frequency
+        self.quiet = quiet
+        self.window = window
+        self.on_shake = on_shake
+        self.on_calm = on_calm
+        self.shaking = False
+        self.last_loud = None  # 揺れ終了閾値以上だった最後の時刻
+        self.calm_since = None  # 最後に揺れが終了した時刻
+        self.shakes = 0
+
+    def update(self, times, samples):
+        """
+        @param times:判定期間を含む時刻の配列(古い順)
+        @param samples:(件数, 3)の配列
+        @return 状態が変わった場合True
+        """
+        if len(times) == 0:
+            return False
+        magnitude = dynamic_magnitude(samples)
+        now = float(times[-1])
+        loud = numpy.nonzero(magnitude >= self.los_value)[0]
+        if len(loud) > 0:
+            self.last_loud = float(times[loud[-1]])
+        if not self.shaking:
+            # 前回の揺れのサンプルは数えない
+            start = now - self.window
+            if (self.calm_since is not None) and (self.calm_since > start):
+                start = self.calm_since
+            recent = times > start
+            if numpy.count_nonzero(magnitude[recent] > self.det_value) >= self.frequency:
+                self.shaking = True
+                self.shakes += 1
+                if self.on_shake is not None:
+                    self.on_shake(now)
+                return True
+            return False
+        if (self.last_loud is None) or (now - self.last_loud >= self.quiet):
+            self.shaking = False
+            self.calm_since = now
+            if self.on_calm is not None:
+                self.on_calm(now)
+            return True
+        return False
+
+
+class AccStream:
+    """
+    受信した加速度データをリングバッファに記録する(メモリ使用量は一定)
+        acc = AccStream(papero, detector=ShakeDetector(0.5, 0.2))
+        papero.send_set_acc_sensor(1000, 0, 5)
+        ...
+        print(acc.stats(1.0))
+    """
+
+    def __init__(self, papero=None, capacity=4096, rate=100.0, detector=None, check_interval=0.02,
+                 event=ACC_EVENT, fields=ACC_FIELDS):
+        """
+        @param papero:Papero(Noneならappend()で手動で追加する)
+        @param capacity:保持するサンプル数
+        @param rate:サンプリング周波数(Hz、1伝文に複数サンプルがある場合の時刻の割り当てに使う)
+        @param detector:ShakeDetector
+        @param check_interval:揺れ検出を行う間隔(秒)
+        @param event:加速度データの伝文名
+        @param fields:X・Y・Zの項目名(値はカンマ区切りで複数サンプルも可)
+        """
+        self.ring = AccRing(capacity)
+        self.rate = rate
+        self.detector = detector
+        self.check_interval = check_interval
+        self.checked = None
+        self.fields = fields
+        self.lock = threading.Lock()
+        self.papero = papero
+        self.subscription = None
+        if papero is not None:
+            self.subscription = papero.on(event, self.on_message)
+
+    def on_message(self, message):
+        """
+        加速度データ伝文の処理(受信スレッド)
+        """
+        try:
+            axes = [papero_face.parse_numbers([str(message[field])], numpy.float32) for field in self.fields]
+        except (KeyError, ValueError):
+            logger.warning("------Invalid acceleration data : " + str(message))
+            return
+        n = min(len(a) for a in axes)
+        samples = numpy.stack([a[:n] for a in axes], axis=1)
+        now = time.monotonic()
+        self.append(now - numpy.arange(n - 1, -1, -1) / self.rate, samples)
+
+    def append(self, times, samples):
+        """
+        @param times:時刻(秒)の配列
+        @param samples:(件数, 3)の配列
+        """
+        with self.lock:
+            self.ring.extend(numpy.asarray(times, dtype=numpy.float64), numpy.asarray(samples, dtype=numpy.float32))
+            if self.detector is None:
+                return
+            now = self.ring.times[self.ring.head - 1]
+            if (self.checked is not None) and (now - self.checked < self.check_interval):
+                return
+            self.checked = now
+            times, samples = self.ring.window(max(self.detector.window, self.check_interval))
+            self.detector.update(times, samples)
+
+    def window(self, seconds):
+        """
+        @return (時刻, サンプル)のコピー(古い順、最新サンプルからseconds秒以内)
+        """
+        with self.lock:
+            return self.ring.window(seconds)
+
+    def stats(self, seconds):
+        """
+        @param seconds:集計する期間(秒)
+        @return motion_stats()の結果
+        """
+        return motion_stats(*self.window(seconds))
+
+    @property
+    def shaking(self):
+        return (self.detector is not None) and self.detector.shaking
+
+    def close(self):
+        if self.subscription is not None:
+            self.papero.off(self.subscription)
+            self.subscription = None
@@ -0,0 +1,264 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 制御用ライブラリ(asyncio版)
+# ライセンス：MIT
+##############################################################
+from logging import getLogger, DEBUG
+logger = getLogger(__name__)
+
+import asyncio
+import time
+
+from tornado.websocket import websocket_connect
+
+import pypapero
+import papero_inbound
+import papero_scheduler
+
+
+class AsyncPapero(pypapero.Papero):
+    """
+    asyncioイベントループ上で動作するPaperoクラス
+
+    send_*はPaperoと同じ(送信はノンブロッキング)。
+    初期化・受信・終了処理はコルーチンとなる。
+        papero = await AsyncPapero.create(simulator_id, robot_name, "")
+    """
+
+    def __init__(self, simulator_id, robot_name, arg_ws_server_addr):
+        """
+        接続はしない(papero_init()またはcreate()で接続する)
+        @param simulator_id:シミュレータID
+        @param robot_name:ロボット名
+        @param arg_ws_server_addr:WebSocket接続先(""ならデフォルトの接続先)
+        """
+        self.papero_setup(simulator_id, robot_name, arg_ws_server_addr)
+        self.queFromCom = papero_inbound.AsyncInboundQueue()
+        self.reader = None
+        self.speech_changed = None  # 発話の完了を通知するasyncio.Event
+
+    @classmethod
+    async def create(cls, simulator_id, robot_name, arg_ws_server_addr, init_timeout=None):
+        """
+        生成して初期化まで行う
+        @param init_timeout:Ready受信までの待ち時間(秒、Noneなら無制限)
+        @return AsyncPaperoインスタンス
+        """
+        papero = cls(simulator_id, robot_name, arg_ws_server_addr)
+        await papero.papero_init(init_timeout)
+        return papero
+
+    async def papero_connect(self):
+        """
+        WebSocket接続
+        """
+        try:
+            self.ws = await websocket_connect(self.wsServerAddr)
+        except Exception as e:
+            self.errOccurred = 2
+            self.errDetail = "Connection failed"
+            logger.error("------Error occurred(papero_connect()). Detail : " + str(e))
+            return
+        self.wsAvail = True
+        self.wsOpened.set()
+        self.reader = asyncio.ensure_future(self.papero_read_loop())
+
+    async def papero_read_loop(self):
+        """
+        受信ループ(PaperoClient.received_message/closedに相当)
+        """
+        ws = self.ws
+        while True:
+            message = await ws.read_message()
+            if message is None:
+                break
+            if logger.isEnabledFor(DEBUG):
+                logger.debug("received:" + message)
+            self.papero_dispatch(message)
+        self.wsAvail = False
+        # 切断済みの接続に送信しないよう外す(以後のsend_*は送信しない)
+        if self.ws is ws:
+            self.ws = None
+        self.papero_dispatch(None)
+
+    async def papero_init(self, timeout=None):
+        """
+        パペロ初期化(Ready受信で即座に完了する)
+        @param timeout:Ready受信までの待ち時間(秒、Noneなら無制限)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self.papero_connect(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.wsAvail:
+            self.send_select_sim_robot()
+        elif self.errOccurred != 0:
+            return
+        while True:
+            remain = None if deadline is None else deadline - time.monotonic()
+            if (remain is not None) and (remain <= 0):
+                self.errOccurred = 2
+                self.errDetail = "Initialize timed out"
+                logger.error("------Error occurred(papero_init()). Detail : " + self.errDetail)
+                self.papero_send(None)
+                return
+            if self.papero_init_step(await self.papero_recv(remain)):
+                return
+
+    def papero_send(self, msg_dic_snd):
+        """
+        伝文送信(送信バッファへの書き込みのみ行い待たない)
+        @param msg_dic_snd:送信する辞書又はJSON文字列(Noneを設定すると回線を切断する)
+        """
+        if self.ws is not None:
+            if msg_dic_snd is None:
+                self.papero_flush_batch()
+                self.scriptMayFinish = True
+                self.ws.close()
+                self.wsAvail = False
+                self.ws = None
+            else:
+                if isinstance(msg_dic_snd, str):
+                    msg_json_snd = msg_dic_snd
+                else:
+                    msg_json_snd = pypapero.json_dumps(msg_dic_snd)
+                self.ws.write_message(msg_json_snd)
+                self.metrics.frame_sent(msg_json_snd)
+                if logger.isEnabledFor(DEBUG):
+                    logger.debug("sending:" + msg_json_snd)
+
+    def papero_start_batch_timer(self, t):
+        """
+        まとめ送り用タイマー開始(イベントループ上で送信する)
+        @param t:待ち時間
+        @return タイマー
+        """
+        return asyncio.get_event_loop().call_later(t, self.papero_flush_batch)
+
+    def papero_start_scheduler(self, rates=None):
+        """
+        送信スケジューラ開始(送信はイベントループ上のタスクで行う)
+        @param rates:送信先→(1秒あたりのコマンド数, バースト数)
+        """
+        if self.scheduler is not None:
+            return
+        self.scheduler = papero_scheduler.OutboundScheduler(rates)
+        self.scheduler_event = asyncio.Event()
+        asyncio.ensure_future(self.papero_scheduler_loop(self.scheduler))
+
+    def papero_wake_scheduler(self):
+        self.scheduler_event.set()
+
+    async def papero_scheduler_loop(self, scheduler):
+        """
+        送信タスク
+        @param scheduler:OutboundScheduler
+        """
+        while self.scheduler is scheduler:
+            now = time.monotonic()
+            messages = scheduler.pop_ready(now, pypapero.BATCH_MAX_MESSAGES)
+            if len(messages) > 0:
+                self.papero_transmit_messages(messages)
+                continue
+            wake = scheduler.next_ready_time(now)
+            self.scheduler_event.clear()
+            try:
+                await asyncio.wait_for(self.scheduler_event.wait(), None if wake is None else wake - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def papero_recv(self, t):
+        """
+        伝文受信
+        @param t:タイムアウト(Noneの場合は受信できるまで待つ)
+        @return 受信伝文、t秒以内に受信できなかった場合はNone
+        """
+        try:
+            message = await asyncio.wait_for(self.queFromCom.get(), t)
+            if message is None:
+                if not self.scriptMayFinish:
+                    self.errOccurred = 2
+                    self.errDetail = "Disconnected"
+                    logger.error("------Error occurred(papero_recv()). Detail : " + self.errDetail)
+        except asyncio.TimeoutError:
+            message = None
+        return message
+
+    async def papero_robot_message_recv(self, t):
+        """
+        ロボット伝文受信
+        @param t:タイムアウト
+        @return 受信伝文の配列、t秒以内に受信できなかった場合はNone
+        """
+        return self.papero_handle_robot_message(await self.papero_recv(t))
+
+    async def papero_wait_response(self, message_id, t):
+        """
+        応答(*Res)受信待ち
+        @param message_id:send_*が返したmessageID
+        @param t:タイムアウト(Noneの場合は受信できるまで待つ)
+        @return 応答伝文(辞書)、t秒以内に受信できなかった場合はNone
+        """
+        future = asyncio.wrap_future(self.papero_response_future(message_id))
+        try:
+            # 応答待ちFutureは共有なのでタイムアウトしてもキャンセルしない
+            return await asyncio.wait_for(asyncio.shield(future), t)
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError, papero_scheduler.CommandSuperseded):
+            return None
+
+    async def wait_speech_done(self, message_id, timeout=None):
+        """
+        発話の完了待ち
+        @param message_id:send_start_speechが返したmessageID
+        @param timeout:タイムアウト(Noneの場合は完了するまで待つ)
+        @return 完了した場合True、タイムアウト又は切断された場合False
+        """
+        return (await self.papero_wait_response(message_id, timeout)) is not None
+
+    async def all_speech_done(self, timeout=None):
+        """
+        送信済みのすべての発話の完了待ち(切断された発話は完了扱い)
+        @param timeout:タイムアウト(Noneの場合は完了するまで待つ)
+        @return 完了した場合True、タイムアウトした場合False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.speech_lock:
+                if len(self.speech_pending) == 0:
+                    return True
+            remain = None if deadline is None else deadline - time.monotonic()
+            if (remain is not None) and (remain <= 0):
+                return False
+            # 応答待ちFutureは呼び出し側がキャンセルすることがあるので、完了の通知を待つ
+            if self.speech_changed is None:
+                self.speech_changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.speech_changed.wait(), remain)
+            except asyncio.TimeoutError:
+                pass
+
+    def papero_speech_finished(self, message_id):
+        super().papero_speech_finished(message_id)
+        if self.speech_changed is not None:
+            self.speech_changed.set()
+            self.speech_changed = None
+
+    async def papero_cleanup(self):
+        """
+        終了処理
+        """
+        self.papero_flush_batch()
+        self.papero_stop_scheduler()
+        if self.errOccurred == 0:
+            self.send_script_end()
+        if self.ws is None:
+            return
+        self.scriptMayFinish = True
+        ws = self.ws
+        await self.all_speech_done(pypapero.SPEECH_DONE_TIMEOUT)
+        ws.close()
+        self.wsAvail = False
+        self.ws = None
+        if self.reader is not None:
+            await self.reader
@@ -0,0 +1,307 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i カメラ画像の共有メモリ受け取り
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import os
+import time
+import zlib
+import struct
+import threading
+from multiprocessing import shared_memory
+
+import numpy
+
+# 共有メモリ先頭のヘッダ(連番, 時刻ns)。連番は書き込み中は奇数
+HEADER = struct.Struct("<QQ")
+
+CAMERA_SIZES = {"VGA": (640, 480), "XGA": (1024, 768), "SXGA": (1280, 1024)}
+RESULT_OK = "OK"  # 応答のResult
+
+# このプロセスで作成した共有メモリ名(削除は作成側が行う)
+created_names = set()
+created_lock = threading.Lock()
+
+
+def frame_size(width, height, channels=3, header=True):
+    """
+    @return 共有メモリに必要なバイト数(ShareMemSize)
+    """
+    return (HEADER.size if header else 0) + width * height * channels
+
+
+class CaptureError(Exception):
+    """
+    撮影を開始できなかった・撮影中に切断された
+    """
+    pass
+
+
+def create_shared_memory(name, size):
+    """
+    共有メモリを作成する(unlink_shared_memory()で削除すること)
+    """
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    with created_lock:
+        created_names.add(shm.name)
+    return shm
+
+
+def unlink_shared_memory(shm):
+    """
+    create_shared_memory()で作成した共有メモリを削除する
+    """
+    with created_lock:
+        created_names.discard(shm.name)
+    shm.unlink()
+
+
+def attach_shared_memory(name):
+    """
+    既存の共有メモリを開く
+    他のプロセスが作成したものは、このプロセスの終了時に削除されないようresource_trackerから外す
+    (このプロセスで作成したものは作成側のunlinkで登録が外れるので外さない)
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    with created_lock:
+        owned = shm.name in created_names
+    if (not owned) and (os.name == "posix"):
+        from multiprocessing import resource_tracker
+        # POSIXでは先頭に"/"を付けた名前で登録される
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+    return shm
+
+
+class Frame:
+    """
+    共有メモリ上の1フレーム(コピーしない)
+    次のフレームが書き込まれると内容が変わるので、保持する場合はcopy()すること
+    """
+
+    def __init__(self, stream, seq, timestamp):
+        self.stream = stream
+        self.seq = seq
+        self.timestamp = timestamp  # 書き込み時刻(ns、ヘッダなしの場合は受信時刻)
+
+    @property
+    def data(self):
+        """
+        画素データのmemoryview
+        """
+        return self.stream.pixels
+
+    @property
+    def array(self):
+        """
+        画素データのndarray(高さ×幅×チャンネル)
+        """
+        return self.stream.array
+
+    def valid(self):
+        """
+        @return 処理中に次のフレームで上書きされていなければTrue
+        """
+        return (not self.stream.header) or (self.stream.read_seq() == self.seq)
+
+    def copy(self):
+        return self.stream.array.copy()
+
+
+class FrameStream:
+    """
+    共有メモリに書き込まれるカメラ画像をフレーム単位で読む
+        with FrameStream("papero_cam", 640, 480) as stream:
+            for frame in stream.frames(timeout=5.0):
+                process(frame.array)
+    """
+
+    def __init__(self, name, width, height, channels=3, header=True, shm=None):
+        """
+        @param name:共有メモリ名(ShareMemID)
+        @param width:幅
+        @param height:高さ
+        @param channels:1画素のバイト数
+        @param header:先頭にHEADER(連番・時刻)があるか(Falseなら画素のCRCで更新を判定する)
+        @param shm:作成済みのSharedMemory(Noneならnameで開く)
+        """
+        self.name = name
+        self.header = header
+        self.shm = attach_shared_memory(name) if shm is None else shm
+        offset = HEADER.size if header else 0
+        size = width * height * channels
+        if self.shm.size < offset + size:
+            self.shm.close()
+            raise ValueError("shared memory too small: %d < %d" % (self.shm.size, offset + size))
+        self.pixels = self.shm.buf[offset:offset + size]
+        self.array = numpy.ndarray((height, width, channels), dtype=numpy.uint8, buffer=self.pixels)
+        self.last = None
+        self.skipped = 0
+
+    def read_seq(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def poll(self):
+        """
+        新しいフレームがあれば返す
+        @return Frame(更新がなければNone)
+        """
+        if self.header:
+            seq, timestamp = HEADER.unpack_from(self.shm.buf, 0)
+            if (seq & 1) or (seq == 0):
+                return None  # 書き込み中又は未書き込み
+        else:
+            seq = zlib.crc32(self.pixels)
+            timestamp = time.time_ns()
+        if seq == self.last:
+            self.skipped += 1
+            return None
+        self.last = seq
+        return Frame(self, seq, timestamp)
+
+    def frames(self, interval=0.002, timeout=None):
+        """
+        新しいフレームを順に返すジェネレータ(変化のないフレームは飛ばす)
+        @param interval:更新確認の間隔(秒)
+        @param timeout:新しいフレームがtimeout秒来なければ終了(Noneなら無限)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.shm is not None:
+            frame = self.poll()
+            if frame is not None:
+                yield frame
+                if timeout is not None:
+                    deadline = time.monotonic() + timeout
+                continue
+            if (deadline is not None) and (time.monotonic() > deadline):
+                return
+            time.sleep(interval)
+
+    def close(self):
+        if self.shm is None:
+            return
+        # 共有メモリを閉じる前にビューを解放する
+        self.array = None
+        try:
+            self.pixels.release()
+            self.shm.close()
+        except BufferError:
+            logger.warning("------Frame views still in use. Shared memory is closed when they are released : " + self.name)
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CameraStream(FrameStream):
+    """
+    startCapturingで撮影を開始し、共有メモリのフレームを読む(close()でstopCapturing)
+        with CameraStream(papero, "papero_cam", "VGA") as stream:
+            for frame in stream.frames():
+                ...
+    共有メモリは読み手が作成し、名前をShareMemIDとして通知する
+    ヘッダなしの場合はgetCaptureDataで1フレームずつ書き込ませ、getCaptureDataResを受け取ったら返す
+    (次のフレームは前のフレームを返した後に要求するので、処理中に上書きされない)
+    """
+
+    def __init__(self, papero, name, camera="VGA", channels=3, header=False, timeout=5.0):
+        """
+        @param papero:Paperoインスタンス
+        @param name:共有メモリ名(ShareMemID)
+        @param camera:"VGA"/"XGA"/"SXGA"
+        @param header:先頭にHEADERがあるか(ロボットは画素のみを書き込むので通常はFalse、FrameWriterで試す場合のみTrue)
+        @param timeout:startCapturingRes・getCaptureDataResの待ち時間
+        """
+        width, height = CAMERA_SIZES[camera]
+        size = frame_size(width, height, channels, header)
+        self.papero = papero
+        self.camera = camera
+        self.timeout = timeout
+        self.captured = 0
+        shm = create_shared_memory(name, size)
+        try:
+            super().__init__(name, width, height, channels, header, shm)
+            response = papero.papero_wait_response(papero.send_start_capturing(name, size, camera), timeout)
+            if response is None:
+                raise CaptureError("no startCapturingRes (timeout or disconnected)")
+            if response.get("Result", RESULT_OK) != RESULT_OK:
+                raise CaptureError("startCapturing failed: " + str(response.get("Result")))
+        except Exception:
+            super().close()
+            unlink_shared_memory(shm)
+            raise
+
+    def poll(self):
+        """
+        ヘッダなしの場合はgetCaptureDataResをフレームの書き込み完了の通知とする(画素を走査しない)
+        @return Frame(timeout秒以内に書き込まれなければNone)
+        """
+        if self.header:
+            return super().poll()
+        response = self.papero.papero_wait_response(self.papero.send_get_capture_data(self.name, self.camera),
+                                                    self.timeout)
+        if response is None:
+            if self.papero.errOccurred != 0:
+                raise CaptureError("disconnected while capturing")
+            return None
+        if response.get("Result", RESULT_OK) != RESULT_OK:
+            self.skipped += 1
+            logger.debug("------getCaptureData failed : " + str(response.get("Result")))
+            return None
+        self.captured += 1
+        return Frame(self, self.captured, time.time_ns())
+
+    def close(self):
+        if self.shm is None:
+            return
+        if self.papero.errOccurred == 0:
+            self.papero.send_stop_capturing(self.name, self.camera)
+        shm = self.shm
+        super().close()
+        unlink_shared_memory(shm)
+
+
+class FrameWriter:
+    """
+    共有メモリへのフレーム書き込み(テスト・シミュレーション用の代替カメラ)
+        writer = FrameWriter("papero_cam", 640, 480)
+        writer.write(image)  # bytes又はndarray
+    """
+
+    def __init__(self, name, width, height, channels=3, header=True, create=True):
+        self.header = header
+        self.size = width * height * channels
+        if create:
+            self.shm = create_shared_memory(name, frame_size(width, height, channels, header))
+        else:
+            self.shm = attach_shared_memory(name)
+        self.owner = create
+        self.offset = HEADER.size if header else 0
+        self.seq = 0
+
+    def write(self, image):
+        """
+        @param image:width×height×channelsバイトの画素データ
+        """
+        data = memoryview(image).cast("B")
+        if len(data) != self.size:
+            raise ValueError("frame size mismatch: %d != %d" % (len(data), self.size))
+        if self.header:
+            HEADER.pack_into(self.shm.buf, 0, self.seq + 1, 0)  # 書き込み中(奇数)
+        self.shm.buf[self.offset:self.offset + self.size] = data
+        if self.header:
+            self.seq += 2
+            HEADER.pack_into(self.shm.buf, 0, self.seq, time.time_ns())
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        if self.owner:
+            unlink_shared_memory(self.shm)
+        self.shm = None
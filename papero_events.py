@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i イベント購読
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import threading
+import fnmatch
+
+
+class Subscription:
+    """
+    購読1件分(off()に渡すハンドル)
+    """
+
+    def __init__(self, pattern, callback, predicate, executor):
+        self.pattern = pattern
+        self.callback = callback
+        self.predicate = predicate
+        self.executor = executor
+        self.active = True
+
+    def matches(self, name, msg):
+        if (self.pattern != name) and not fnmatch.fnmatchcase(name, self.pattern):
+            return False
+        return (self.predicate is None) or self.predicate(msg)
+
+    def offer(self, name, msg):
+        """
+        条件に合えば配信する(述語・executorの例外も記録のみ行い、受信スレッドには伝えない)
+        """
+        try:
+            if self.matches(name, msg):
+                self.deliver(msg)
+        except Exception:
+            logger.exception("------Error occurred(event dispatch). Name : " + str(name))
+
+    def deliver(self, msg):
+        if self.executor is not None:
+            self.executor.submit(self.run, msg)
+        else:
+            self.run(msg)
+
+    def run(self, msg):
+        if not self.active:
+            return
+        try:
+            self.callback(msg)
+        except Exception:
+            logger.exception("------Error occurred(event callback). Name : " + str(msg.get("Name")))
+
+
+class EventDispatcher:
+    """
+    伝文名ごとの購読管理と配信
+    購読リストはコピーオンライトで、配信時はロックを取らない
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exact = {}  # 伝文名→Subscriptionのタプル
+        self.wildcard = ()  # ワイルドカードを含む購読
+
+    def subscribe(self, pattern, callback, predicate=None, executor=None):
+        """
+        @param pattern:伝文名("detectFace")又はワイルドカード("*"、"detect*"など)
+        @param callback:callback(msg) msgは伝文の辞書
+        @param predicate:predicate(msg)がTrueの伝文のみ配信(Noneなら全て)
+        @param executor:指定した場合はexecutor.submitで非同期に呼ぶ(重い処理用)
+        @return Subscription
+        """
+        sub = Subscription(pattern, callback, predicate, executor)
+        with self.lock:
+            if any(c in pattern for c in "*?["):
+                self.wildcard = self.wildcard + (sub,)
+            else:
+                self.exact[pattern] = self.exact.get(pattern, ()) + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.active = False
+        with self.lock:
+            if sub in self.wildcard:
+                self.wildcard = tuple(s for s in self.wildcard if s is not sub)
+            subs = self.exact.get(sub.pattern)
+            if subs is not None:
+                subs = tuple(s for s in subs if s is not sub)
+                if len(subs) > 0:
+                    self.exact[sub.pattern] = subs
+                else:
+                    del self.exact[sub.pattern]
+
+    def has_subscribers(self, name):
+        """
+        @return nameの伝文を受け取る購読がある場合True(述語は評価しない)
+        """
+        if name in self.exact:
+            return True
+        for sub in self.wildcard:
+            if fnmatch.fnmatchcase(name, sub.pattern):
+                return True
+        return False
+
+    def dispatch(self, msg):
+        """
+        伝文1件を購読者に配信(受信スレッドから呼ばれる)
+        @param msg:伝文の辞書
+        """
+        name = msg.get("Name", "")
+        for sub in self.exact.get(name, ()):
+            sub.offer(name, msg)
+        for sub in self.wildcard:
+            sub.offer(name, msg)
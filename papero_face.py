@@ -0,0 +1,196 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 顔検出イベントの一括解析
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import time
+import threading
+import collections
+
+import numpy
+
+# detectFaceイベントの項目名
+POSITION_FIELD = "Position"
+EYE_DISTANCE_FIELD = "EyeDistance"
+
+STRIP_PARENS = {ord("("): None, ord(")"): None}
+
+
+def parse_numbers(texts, dtype=numpy.float64):
+    """
+    数値文字列(座標は"(x,y)"形式も可)のリストを1回で配列に変換
+    @param texts:文字列のリスト
+    @param dtype:要素の型
+    @return 1次元配列(座標は要素を順に並べたもの)
+    """
+    if len(texts) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    joined = ",".join(texts).translate(STRIP_PARENS)
+    rtn = numpy.fromstring(joined, dtype=dtype, sep=",")
+    if len(rtn) != joined.count(",") + 1:
+        raise ValueError("invalid number in: " + joined[:64])
+    return rtn
+
+
+def parse_coords(coords, dtype=numpy.float64):
+    """
+    get_numstr_list_from_coordの一括版
+    @param coords:"(x,y)"形式の座標文字列のリスト
+    @return (件数, 2)の配列
+    """
+    rtn = parse_numbers(coords, dtype)
+    if len(rtn) != 2 * len(coords):
+        raise ValueError("coordinates must have 2 elements")
+    return rtn.reshape(-1, 2)
+
+
+def parse_times(times):
+    """
+    伝文のTime("YYYY-MM-DD hh:mm:ss")をUNIX時刻(秒)の配列に変換
+    """
+    return numpy.array(times, dtype="datetime64[s]").astype(numpy.float64)
+
+
+class FaceBatch:
+    """
+    顔検出イベントの配列表現(時刻順)
+    positions:(件数, 2)の顔の座標
+    eye_distances:目の間隔
+    timestamps:受信時刻(秒)
+    """
+
+    def __init__(self, positions, eye_distances, timestamps):
+        self.positions = positions
+        self.eye_distances = eye_distances
+        self.timestamps = timestamps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def since(self, t):
+        """
+        @return 時刻t以降のイベントのFaceBatch
+        """
+        i = numpy.searchsorted(self.timestamps, t, side="left")
+        return FaceBatch(self.positions[i:], self.eye_distances[i:], self.timestamps[i:])
+
+    def window(self, seconds):
+        """
+        @return 最後のイベントからseconds秒以内のイベントのFaceBatch
+        """
+        if len(self) == 0:
+            return self
+        return self.since(self.timestamps[-1] - seconds)
+
+    def centroid(self, seconds=None):
+        """
+        @param seconds:集計する期間(秒、Noneなら全件)
+        @return 座標の平均(x, y)(イベントがなければNone)
+        """
+        batch = self if seconds is None else self.window(seconds)
+        if len(batch) == 0:
+            return None
+        return batch.positions.mean(axis=0)
+
+    def velocity(self, seconds=None):
+        """
+        最小二乗法で求めた座標の変化速度
+        @param seconds:集計する期間(秒、Noneなら全件)
+        @return (vx, vy)(1秒あたり、2件未満又は時刻が同じ場合はNone)
+        """
+        batch = self if seconds is None else self.window(seconds)
+        if len(batch) < 2:
+            return None
+        t = batch.timestamps - batch.timestamps.mean()
+        denom = numpy.dot(t, t)
+        if denom == 0.0:
+            return None
+        return numpy.dot(t, batch.positions - batch.positions.mean(axis=0)) / denom
+
+    def mean_eye_distance(self, seconds=None):
+        batch = self if seconds is None else self.window(seconds)
+        if len(batch) == 0:
+            return None
+        return float(batch.eye_distances.mean())
+
+
+def parse_face_events(messages, timestamps=None, position=POSITION_FIELD, eye_distance=EYE_DISTANCE_FIELD):
+    """
+    detectFaceイベントのリストをFaceBatchに変換
+    @param messages:detectFaceイベント(辞書)のリスト
+    @param timestamps:受信時刻のリスト(Noneなら各イベントのTime)
+    @param position:座標の項目名
+    @param eye_distance:目の間隔の項目名
+    @return FaceBatch
+    """
+    positions = parse_coords([m[position] for m in messages])
+    distances = parse_numbers([str(m.get(eye_distance, "nan")) for m in messages])
+    if timestamps is None:
+        times = parse_times([m["Time"] for m in messages])
+    else:
+        times = numpy.asarray(timestamps, dtype=numpy.float64)
+    return FaceBatch(positions, distances, times)
+
+
+class FaceWindow:
+    """
+    直近のdetectFaceイベントを保持し、必要な時に一括で配列に変換する
+    (受信時は文字列を記録するだけ)
+        window = FaceWindow(papero)
+        ...
+        batch = window.batch(0.5)
+        print(batch.centroid(), batch.velocity())
+    """
+
+    def __init__(self, papero=None, capacity=256, position=POSITION_FIELD, eye_distance=EYE_DISTANCE_FIELD):
+        """
+        @param papero:Papero(Noneならappend()で手動で追加する)
+        @param capacity:保持するイベント数
+        """
+        self.position = position
+        self.eye_distance = eye_distance
+        self.lock = threading.Lock()
+        self.events = collections.deque(maxlen=capacity)  # (座標, 目の間隔, 受信時刻)
+        self.papero = papero
+        self.subscription = None
+        if papero is not None:
+            self.subscription = papero.on("detectFace", self.append)
+
+    def append(self, message, timestamp=None):
+        """
+        @param message:detectFaceイベント(辞書)
+        @param timestamp:受信時刻(Noneならtime.monotonic())
+        """
+        coord = message.get(self.position)
+        if coord is None:
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self.lock:
+            self.events.append((coord, str(message.get(self.eye_distance, "nan")), timestamp))
+
+    def batch(self, seconds=None):
+        """
+        @param seconds:現在からさかのぼる秒数(Noneなら保持している全件)
+        @return FaceBatch
+        """
+        with self.lock:
+            events = list(self.events)
+        if seconds is not None:
+            start = time.monotonic() - seconds
+            events = [e for e in events if e[2] >= start]
+        coords, distances, times = zip(*events) if len(events) > 0 else ((), (), ())
+        return FaceBatch(parse_coords(coords), parse_numbers(distances),
+                         numpy.array(times, dtype=numpy.float64))
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+
+    def close(self):
+        if self.subscription is not None:
+            self.papero.off(self.subscription)
+            self.subscription = None
@@ -0,0 +1,222 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 受信伝文バッファ
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import threading
+import time
+import queue
+import asyncio
+import collections
+
+# 保持ポリシー
+CONTROL = "control"  # 破棄しない(Ready/Error/RobotEnd、回線切断)
+KEEP = "keep"  # 応答伝文。max_replies を超えた場合のみ古いものから破棄
+LATEST = "latest"  # 同じ名前の伝文は最新の1件のみ保持
+DROP_OLDEST = "drop_oldest"  # max_events を超えたら古いものから破棄
+
+CONTROL_NAMES = ("Ready", "Error", "RobotEnd")
+
+MAX_EVENTS = 256  # DROP_OLDESTの伝文の保持上限(LATESTの伝文は名前ごとに1件で別枠)
+MAX_REPLIES = 1024  # 応答伝文の保持上限
+DROP_WARNING_INTERVAL = 10.0  # 応答伝文の破棄を警告する間隔(秒)
+
+
+def default_policy(name):
+    """
+    伝文名から保持ポリシーを決める
+    ・Ready/Error/RobotEnd、回線切断(None) → CONTROL
+    ・*Res → KEEP
+    ・名前に"Sensor"を含むイベント → LATEST
+    ・その他のイベント → DROP_OLDEST
+    """
+    if (name is None) or (name in CONTROL_NAMES):
+        return CONTROL
+    if name.endswith("Res"):
+        return KEEP
+    if "Sensor" in name:
+        return LATEST
+    return DROP_OLDEST
+
+
+class InboundBuffer:
+    """
+    伝文名ごとの保持ポリシーを持つ上限付きFIFO(排他制御なし)
+    """
+
+    def __init__(self, max_events=MAX_EVENTS, max_replies=MAX_REPLIES):
+        self.max_events = max_events
+        self.max_replies = max_replies
+        self.policies = {}  # 伝文名→ポリシー(default_policyより優先)
+        self.entries = collections.deque()  # [伝文, 名前, 区分, 有効] (到着順)
+        self.fifo = {KEEP: collections.deque(), DROP_OLDEST: collections.deque()}
+        self.count = {CONTROL: 0, KEEP: 0, DROP_OLDEST: 0, LATEST: 0}
+        self.latest = {}  # 伝文名→LATEST伝文のエントリ
+        self.dropped = collections.Counter()  # 伝文名→破棄数
+        self.warned = None  # 最後に応答伝文の破棄を警告した時刻
+        self.unwarned = 0  # 前回の警告以降に破棄した応答伝文の数
+
+    def set_policy(self, name, policy):
+        self.policies[name] = policy
+
+    def policy_for(self, name):
+        if (name is None) or (name in CONTROL_NAMES):
+            return CONTROL
+        policy = self.policies.get(name)
+        if policy is None:
+            policy = default_policy(name)
+        return policy
+
+    def push(self, item, name):
+        policy = self.policy_for(name)
+        # LATEST伝文は名前ごとに1件なのでmax_eventsの対象外(他のイベントで押し出されない)
+        cls = policy
+        entry = [item, name, cls, True]
+        if policy == LATEST:
+            old = self.latest.get(name)
+            if (old is not None) and old[3]:
+                self.kill(old)
+                self.dropped[name] += 1
+            self.latest[name] = entry
+        self.entries.append(entry)
+        self.count[cls] += 1
+        if cls in (CONTROL, LATEST):
+            return
+        fifo = self.fifo[cls]
+        fifo.append(entry)
+        limit = self.max_replies if cls == KEEP else self.max_events
+        while self.count[cls] > limit:
+            oldest = fifo.popleft()
+            if oldest[3]:
+                self.kill(oldest)
+                self.dropped[oldest[1]] += 1
+                if cls == KEEP:
+                    self.reply_dropped(oldest[1])
+        # 破棄済みエントリが溜まったら詰める(償却O(1))
+        if len(self.entries) > 2 * len(self) + 64:
+            self.entries = collections.deque(e for e in self.entries if e[3])
+            for c in self.fifo:
+                self.fifo[c] = collections.deque(e for e in self.fifo[c] if e[3])
+
+    def reply_dropped(self, name):
+        """
+        応答伝文の破棄をログ出力(件数はdroppedで数えているので警告はDROP_WARNING_INTERVAL秒に1回)
+        """
+        self.unwarned += 1
+        now = time.monotonic()
+        if (self.warned is not None) and (now - self.warned < DROP_WARNING_INTERVAL):
+            logger.debug("------Inbound reply dropped. Name : " + str(name))
+            return
+        logger.warning("------Inbound replies dropped. Count : " + str(self.unwarned) + " Last name : " + str(name))
+        self.warned = now
+        self.unwarned = 0
+
+    def kill(self, entry):
+        entry[3] = False
+        self.count[entry[2]] -= 1
+
+    def pop(self):
+        """
+        @return 最も古い伝文(空ならIndexError)
+        """
+        while True:
+            entry = self.entries.popleft()
+            if entry[3]:
+                self.kill(entry)
+                if self.latest.get(entry[1]) is entry:
+                    del self.latest[entry[1]]
+                fifo = self.fifo.get(entry[2])
+                while (fifo is not None) and (len(fifo) > 0) and (not fifo[0][3]):
+                    fifo.popleft()
+                return entry[0]
+
+    def __len__(self):
+        return self.count[CONTROL] + self.count[KEEP] + self.count[DROP_OLDEST] + self.count[LATEST]
+
+
+class PaperoInboundQueue:
+    """
+    受信伝文キュー(queue.Queueのget/qsizeと互換、上限・保持ポリシー付き)
+    """
+
+    def __init__(self, max_events=MAX_EVENTS, max_replies=MAX_REPLIES):
+        self.buffer = InboundBuffer(max_events, max_replies)
+        self.cond = threading.Condition()
+
+    def put_message(self, item, name):
+        """
+        @param item:受信伝文(Noneは回線切断)
+        @param name:保持ポリシー判定用の伝文名
+        """
+        with self.cond:
+            self.buffer.push(item, name)
+            self.cond.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            if not block:
+                timeout = 0.0
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while len(self.buffer) == 0:
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remain = deadline - time.monotonic()
+                    if remain <= 0:
+                        raise queue.Empty
+                    self.cond.wait(remain)
+            return self.buffer.pop()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def set_policy(self, name, policy):
+        """
+        伝文名ごとの保持ポリシー設定
+        @param policy:KEEP/LATEST/DROP_OLDEST
+        """
+        with self.cond:
+            self.buffer.set_policy(name, policy)
+
+    def dropped(self):
+        """
+        @return 伝文名→破棄数
+        """
+        with self.cond:
+            return dict(self.buffer.dropped)
+
+    def qsize(self):
+        with self.cond:
+            return len(self.buffer)
+
+
+class AsyncInboundQueue:
+    """
+    asyncio版の受信伝文キュー(イベントループのスレッドからのみ使用する)
+    """
+
+    def __init__(self, max_events=MAX_EVENTS, max_replies=MAX_REPLIES):
+        self.buffer = InboundBuffer(max_events, max_replies)
+        self.event = asyncio.Event()
+
+    def put_message(self, item, name):
+        self.buffer.push(item, name)
+        self.event.set()
+
+    async def get(self):
+        while len(self.buffer) == 0:
+            self.event.clear()
+            await self.event.wait()
+        return self.buffer.pop()
+
+    def set_policy(self, name, policy):
+        self.buffer.set_policy(name, policy)
+
+    def dropped(self):
+        return dict(self.buffer.dropped)
+
+    def qsize(self):
+        return len(self.buffer)
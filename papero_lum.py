@@ -0,0 +1,277 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 照度センサのバックグラウンド取得・キャッシュ
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import time
+import asyncio
+import threading
+import collections
+
+# getLumSensorValueResの照度の項目名
+LUM_FIELD = "Value"
+# 読み出し頻度を求める期間(秒)
+DEMAND_WINDOW = 10.0
+
+
+class LumReading:
+    """
+    照度の取得結果
+    """
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.timestamp = time.time()
+        self.monotonic = time.monotonic()
+        self.ttl = ttl
+
+    def age(self):
+        return time.monotonic() - self.monotonic
+
+    def to_dict(self):
+        age = self.age()
+        return {"value": self.value, "timestamp": self.timestamp, "age": round(age, 3),
+                "ttl": round(self.ttl, 3), "stale": age > self.ttl}
+
+
+class LumSampler:
+    """
+    getLumSensorValueを読み手の数と値の変化に合わせた間隔で送信し、最新値をキャッシュする
+    ・値がthreshold以上変化したら間隔を半分に、変化しなければ1.5倍に(min_interval～max_interval)
+    ・読み出しが頻繁な場合は読み出し間隔より長く空けない
+    ・idle秒読み出しがなければ停止し、次の読み出しで再開する
+        sampler = LumSampler(functools.partial(pool.session, simulator_id))
+        reading = sampler.read()
+    """
+
+    def __init__(self, session, min_interval=0.2, max_interval=5.0, threshold=5.0, idle=30.0,
+                 timeout=2.0, ttl_factor=2.0):
+        """
+        @param session:Paperoを返すコンテキストマネージャを生成する関数(例:pool.sessionのpartial)
+        @param min_interval:最短の取得間隔(秒)
+        @param max_interval:最長の取得間隔(秒)
+        @param threshold:間隔を短くする値の変化量
+        @param idle:読み出しがなければ停止するまでの秒数
+        @param timeout:getLumSensorValueResの待ち時間
+        @param ttl_factor:取得間隔の何倍まで値を新しいとみなすか
+        """
+        self.session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.idle = idle
+        self.timeout = timeout
+        self.ttl_factor = ttl_factor
+        self.interval = min_interval
+        self.reading = None
+        self.reads = collections.deque(maxlen=256)  # 読み出し時刻
+        self.samples = 0
+        self.errors = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.wanted = False  # 新しい値を待っている読み手がいる
+
+    def read(self, max_age=None):
+        """
+        最新値を返す(値がないかmax_age秒より古い場合は次の取得を待つ)
+        @param max_age:許容する古さ(秒、Noneなら値があればそのまま返す)
+        @return LumReading(timeout秒以内に取得できなければNone又は古い値)
+        """
+        with self.cond:
+            self.reads.append(time.monotonic())
+            self.start_locked()
+            reading = self.reading
+            if (reading is None) or ((max_age is not None) and (reading.age() > max_age)):
+                self.wanted = True
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.reading is not reading, self.timeout)
+            return self.reading
+
+    def start_locked(self):
+        if self.running:
+            return
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def demand_interval(self, now):
+        """
+        @return 読み出し頻度に応じた取得間隔の上限(読み出しがなければNone)
+        """
+        recent = sum(1 for t in self.reads if now - t <= DEMAND_WINDOW)
+        if recent == 0:
+            return None
+        return min(self.max_interval, max(self.min_interval, DEMAND_WINDOW / recent))
+
+    def update(self, value):
+        """
+        取得値を反映し、次の取得までの秒数を返す(ロック内で呼ぶ、待っている読み手への通知は呼び出し側で行う)
+        """
+        if value is not None:
+            if (self.reading is not None) and (self.reading.value is not None) \
+                    and (abs(value - self.reading.value) >= self.threshold):
+                self.interval = max(self.min_interval, self.interval / 2.0)
+            else:
+                self.interval = min(self.max_interval, self.interval * 1.5)
+        wait = self.interval
+        demand = self.demand_interval(time.monotonic())
+        if demand is not None:
+            wait = min(wait, demand)
+        if value is not None:
+            self.reading = LumReading(value, wait * self.ttl_factor)
+            self.samples += 1
+        self.wanted = False
+        return wait
+
+    def idle_locked(self):
+        return (len(self.reads) == 0) or (time.monotonic() - self.reads[-1] > self.idle)
+
+    def stopped(self):
+        """
+        @return 取得を停止していて読み出しもなければTrue
+        """
+        with self.cond:
+            return (not self.running) and self.idle_locked()
+
+    def run(self):
+        while True:
+            value = self.sample()
+            with self.cond:
+                wait = self.update(value)
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.wanted, wait)
+                if self.idle_locked():
+                    self.running = False
+                    return
+
+    def sample(self):
+        """
+        @return 照度(取得できなければNone)
+        """
+        try:
+            with self.session() as papero:
+                response = papero.papero_wait_response(papero.send_get_lum_sensor_value(), self.timeout)
+            return parse_value(response)
+        except Exception:
+            self.errors += 1
+            logger.exception("------Error occurred(LumSampler.sample())")
+            return None
+
+
+class AsyncLumSampler(LumSampler):
+    """
+    AsyncPapero用(取得はイベントループのタスクで行う)
+        sampler = AsyncLumSampler(functools.partial(pool.session, simulator_id))
+        reading = await sampler.read()
+    """
+
+    def __init__(self, session, **kwargs):
+        """
+        @param session:AsyncPaperoを返す非同期コンテキストマネージャを生成する関数
+        """
+        super().__init__(session, **kwargs)
+        self.acond = asyncio.Condition()
+        self.task = None
+
+    async def read(self, max_age=None):
+        async with self.acond:
+            self.reads.append(time.monotonic())
+            if self.task is None:
+                self.task = asyncio.ensure_future(self.run())
+            reading = self.reading
+            if (reading is None) or ((max_age is not None) and (reading.age() > max_age)):
+                self.wanted = True
+                self.acond.notify_all()
+                try:
+                    await asyncio.wait_for(self.acond.wait_for(lambda: self.reading is not reading), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.reading
+
+    def stopped(self):
+        return (self.task is None) and self.idle_locked()
+
+    async def run(self):
+        try:
+            while True:
+                value = await self.sample()
+                async with self.acond:
+                    wait = self.update(value)
+                    self.acond.notify_all()
+                    try:
+                        await asyncio.wait_for(self.acond.wait_for(lambda: self.wanted), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    if self.idle_locked():
+                        return
+        finally:
+            self.task = None
+
+    async def sample(self):
+        try:
+            async with self.session() as papero:
+                response = await papero.papero_wait_response(papero.send_get_lum_sensor_value(), self.timeout)
+            return parse_value(response)
+        except Exception:
+            self.errors += 1
+            logger.exception("------Error occurred(AsyncLumSampler.sample())")
+            return None
+
+
+def parse_value(response):
+    """
+    @param response:getLumSensorValueRes(辞書)
+    @return 照度(取得できなければNone)
+    """
+    if (response is None) or (LUM_FIELD not in response):
+        return None
+    return float(response[LUM_FIELD])
+
+
+class LumSamplers:
+    """
+    ロボットごとのLumSampler
+    停止したものは新しいロボットの追加時に外し、数はプールの同時接続数の上限までとする
+        samplers = LumSamplers(pool)
+        reading = samplers.get((simulator_id, robot_name)).read()
+    """
+
+    def __init__(self, pool, sampler_class=LumSampler, max_samplers=None, **kwargs):
+        """
+        @param pool:PaperoPool又はAsyncPaperoPool
+        @param sampler_class:LumSampler又はAsyncLumSampler
+        @param max_samplers:保持する数の上限(Noneならpool.max_sessions)
+        @param kwargs:LumSamplerの引数
+        """
+        self.pool = pool
+        self.sampler_class = sampler_class
+        self.max_samplers = pool.max_sessions if max_samplers is None else max_samplers
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.samplers = collections.OrderedDict()  # キー→LumSampler(使われた順)
+
+    def get(self, key):
+        with self.lock:
+            sampler = self.samplers.get(key)
+            if sampler is None:
+                self.evict_locked()
+                sampler = self.sampler_class(lambda: self.pool.session(*key), **self.kwargs)
+                self.samplers[key] = sampler
+            else:
+                self.samplers.move_to_end(key)
+            return sampler
+
+    def evict_locked(self):
+        """
+        停止したものを外し、上限に達していれば最も長く使われていないものを外す(ロック内で呼ぶ)
+        (外した取得が動作中の場合は読み出しがなくなった時点で停止する)
+        """
+        for key, sampler in list(self.samplers.items()):
+            if sampler.stopped():
+                del self.samplers[key]
+        while len(self.samplers) >= max(1, self.max_samplers):
+            self.samplers.popitem(last=False)
@@ -0,0 +1,175 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 通信メトリクス
+# ライセンス：MIT
+##############################################################
+import threading
+import time
+import collections
+
+# send→Res レイテンシのヒストグラム境界(秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 応答待ちとして記録しておくコマンド数の上限
+INFLIGHT_LIMIT = 4096
+
+
+def byte_length(text):
+    """
+    UTF-8でのバイト数
+    @param text:文字列又はバイト列
+    """
+    if isinstance(text, (bytes, bytearray)) or text.isascii():
+        return len(text)
+    return len(text.encode("utf-8"))
+
+
+class Histogram:
+    """
+    累積ヒストグラム(Prometheus形式)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        @return (上限, 累積件数)のリスト(最後は"+Inf")
+        """
+        rtn = []
+        total = 0
+        for bound, n in zip(self.buckets + ("+Inf",), self.counts):
+            total += n
+            rtn.append((bound, total))
+        return rtn
+
+
+class PaperoMetrics:
+    """
+    1接続分のメトリクス
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}  # (Name, Destination)→Histogram
+        self.inflight = collections.OrderedDict()  # MessageID→(Name, Destination, 送信時刻)
+        self.frames = {"in": 0, "out": 0}
+        self.bytes = {"in": 0, "out": 0}
+
+    def frame_sent(self, text):
+        with self.lock:
+            self.frames["out"] += 1
+            self.bytes["out"] += byte_length(text)
+
+    def frame_received(self, text):
+        with self.lock:
+            self.frames["in"] += 1
+            self.bytes["in"] += byte_length(text)
+
+    def command_sent(self, message):
+        """
+        @param message:送信したコマンド辞書
+        """
+        message_id = message.get("MessageID")
+        if message_id is None:
+            return
+        with self.lock:
+            self.inflight[message_id] = (message.get("Name", ""), message.get("Destination", ""),
+                                         time.monotonic())
+            if len(self.inflight) > INFLIGHT_LIMIT:
+                self.inflight.popitem(last=False)
+
+    def response_received(self, message_id):
+        """
+        @param message_id:受信した*ResのMessageID
+        """
+        now = time.monotonic()
+        with self.lock:
+            sent = self.inflight.pop(message_id, None)
+            if sent is None:
+                return
+            name, destination, sent_at = sent
+            histogram = self.latency.get((name, destination))
+            if histogram is None:
+                histogram = Histogram()
+                self.latency[(name, destination)] = histogram
+            histogram.observe(now - sent_at)
+
+    def snapshot(self):
+        """
+        @return (latency, frames, bytes, 応答待ち数) のコピー
+        """
+        with self.lock:
+            latency = {key: (h.cumulative(), h.sum, h.count) for key, h in self.latency.items()}
+            return latency, dict(self.frames), dict(self.bytes), len(self.inflight)
+
+
+def format_labels(labels):
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in labels) + "}"
+
+
+def render_prometheus(sessions):
+    """
+    Prometheusテキスト形式で出力
+    @param sessions:((ラベル名, 値)のタプル, Papero)のリスト
+    @return テキスト
+    """
+    latency_lines = []
+    frame_lines = []
+    byte_lines = []
+    inflight_lines = []
+    queue_lines = []
+    avail_lines = []
+    err_lines = []
+    dropped_lines = []
+    for labels, papero in sessions:
+        latency, frames, nbytes, inflight = papero.metrics.snapshot()
+        for (name, destination), (buckets, total, count) in sorted(latency.items()):
+            lbl = labels + (("name", name), ("destination", destination))
+            for bound, n in buckets:
+                latency_lines.append("papero_command_latency_seconds_bucket%s %d"
+                                     % (format_labels(lbl + (("le", bound),)), n))
+            latency_lines.append("papero_command_latency_seconds_sum%s %.6f" % (format_labels(lbl), total))
+            latency_lines.append("papero_command_latency_seconds_count%s %d" % (format_labels(lbl), count))
+        for direction in ("in", "out"):
+            lbl = format_labels(labels + (("direction", direction),))
+            frame_lines.append("papero_frames_total%s %d" % (lbl, frames[direction]))
+            byte_lines.append("papero_bytes_total%s %d" % (lbl, nbytes[direction]))
+        lbl = format_labels(labels)
+        inflight_lines.append("papero_commands_inflight%s %d" % (lbl, inflight))
+        queue_lines.append("papero_inbound_queue_depth%s %d" % (lbl, papero.queFromCom.qsize()))
+        for name, n in sorted(papero.queFromCom.dropped().items()):
+            dropped_lines.append("papero_inbound_dropped_total%s %d"
+                                 % (format_labels(labels + (("name", name),)), n))
+        avail_lines.append("papero_ws_available%s %d" % (lbl, 1 if papero.wsAvail else 0))
+        err_lines.append("papero_error_occurred%s %d" % (lbl, papero.errOccurred))
+    out = []
+    for name, kind, helptext, lines in (
+            ("papero_command_latency_seconds", "histogram", "Latency from sending a command to its Res.",
+             latency_lines),
+            ("papero_frames_total", "counter", "WebSocket frames by direction.", frame_lines),
+            ("papero_bytes_total", "counter", "WebSocket payload bytes by direction.", byte_lines),
+            ("papero_commands_inflight", "gauge", "Commands sent and still waiting for Res.",
+             inflight_lines),
+            ("papero_inbound_queue_depth", "gauge", "Messages waiting in queFromCom.", queue_lines),
+            ("papero_inbound_dropped_total", "counter", "Inbound messages dropped by retention policy.",
+             dropped_lines),
+            ("papero_ws_available", "gauge", "1 if the WebSocket is connected.", avail_lines),
+            ("papero_error_occurred", "gauge", "Papero.errOccurred (0 means no error).", err_lines)):
+        out.append("# HELP %s %s" % (name, helptext))
+        out.append("# TYPE %s %s" % (name, kind))
+        out.extend(lines)
+    return "\n".join(out) + "\n"
@@ -0,0 +1,425 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 接続プール
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import threading
+import time
+import asyncio
+import collections
+import contextlib
+import functools
+
+import pypapero
+import papero_async
+import papero_teardown
+
+
+class PaperoPoolFull(Exception):
+    """
+    接続数が上限に達し、空きを待てなかった
+    """
+    pass
+
+
+class PaperoSession:
+    """
+    プール内の1接続
+    """
+
+    def __init__(self, key, ready=None):
+        """
+        @param key:(シミュレータID, ロボット名)
+        @param ready:接続完了を通知するイベント(Noneならthreading.Event)
+        """
+        self.key = key
+        self.papero = None
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.deadline = None  # 接続完了を待つ期限
+        if ready is None:
+            ready = threading.Event()
+        self.ready = ready
+
+    def is_healthy(self):
+        """
+        接続が利用可能か
+        """
+        papero = self.papero
+        return (papero is not None) and papero.papero_available()
+
+
+class PaperoPool:
+    """
+    シミュレータID・ロボット名ごとのPapero接続プール
+
+    接続は最初に要求された時に生成し、以後のリクエストで再利用する。
+    未使用のまま idle_ttl 秒経過した接続、及び上限超過時に最も長く
+    使われていない接続は切断される。
+        with pool.session(simulator_id) as papero:
+            operation.hello(papero)
+    """
+
+    def __init__(self, max_sessions=16, idle_ttl=300.0, ws_server_addr="",
+                 factory=None, wait_timeout=10.0, teardown=None):
+        """
+        @param max_sessions:同時接続数の上限
+        @param idle_ttl:未使用接続を切断するまでの秒数
+        @param ws_server_addr:WebSocket接続先(""ならデフォルトの接続先)
+        @param factory:接続生成関数(simulator_id, robot_name, ws_server_addr)
+                       (Noneならinit_timeoutをwait_timeoutにしたpypapero.Papero)
+        @param wait_timeout:上限到達時に空きを待つ秒数、接続完了を待つ秒数
+        @param teardown:切断処理を行うTeardownManager(Noneなら専用に生成)
+        """
+        if factory is None:
+            factory = functools.partial(pypapero.Papero, init_timeout=wait_timeout)
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.ws_server_addr = ws_server_addr
+        self.factory = factory
+        self.wait_timeout = wait_timeout
+        if teardown is None:
+            teardown = papero_teardown.TeardownManager()
+        self.teardown = teardown
+        self.lock = threading.Condition()
+        self.entries = collections.OrderedDict()  # key→PaperoSession(LRU順)
+
+    @contextlib.contextmanager
+    def session(self, simulator_id, robot_name=""):
+        """
+        接続を借りる(withブロックの間は切断されない)
+        @param simulator_id:シミュレータID
+        @param robot_name:ロボット名
+        """
+        entry = self.acquire(simulator_id, robot_name)
+        try:
+            yield entry.papero
+        finally:
+            self.release(entry)
+
+    def acquire(self, simulator_id, robot_name=""):
+        """
+        接続を借りる(release()で返却すること)
+        @return PaperoSession
+        """
+        key = (simulator_id, robot_name)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self.lock:
+                self.evict_idle_locked()
+                entry = self.entries.get(key)
+                if entry is None:
+                    if not self.make_room_locked(deadline):
+                        raise PaperoPoolFull("too many robot sessions")
+                    # 待っている間に他のスレッドが生成している場合がある
+                    entry = self.entries.get(key)
+                if entry is None:
+                    entry = PaperoSession(key)
+                    entry.deadline = time.monotonic() + self.wait_timeout
+                    self.entries[key] = entry
+                    creator = True
+                else:
+                    creator = False
+                entry.users += 1
+                entry.last_used = time.monotonic()
+                self.entries.move_to_end(key)
+            if creator:
+                # 生成関数が戻らなくても待ち続けないよう別スレッドで接続する
+                th = threading.Thread(target=self.connect, args=(entry,))
+                th.daemon = True
+                th.start()
+            if not entry.ready.wait(max(0.0, entry.deadline - time.monotonic())):
+                self.abandon(entry)
+            if entry.is_healthy():
+                return entry
+            self.release(entry)
+            if self.remove_entry(entry):
+                self.close_entry_async(entry)
+            if creator:
+                raise ConnectionError("robot session could not be opened")
+            # 切断済みの接続だったので作り直す
+
+    def connect(self, entry):
+        """
+        接続生成(ロック外で実行)
+        """
+        simulator_id, robot_name = entry.key
+        try:
+            papero = self.factory(simulator_id, robot_name, self.ws_server_addr)
+        except Exception:
+            logger.exception("------Error occurred(PaperoPool.connect())")
+            papero = None
+        self.connected(entry, papero)
+
+    def connected(self, entry, papero):
+        """
+        接続完了を通知する(待ちきれずに外された接続なら切断する)
+        """
+        with self.lock:
+            entry.papero = papero
+            entry.ready.set()
+            abandoned = self.entries.get(entry.key) is not entry
+        if abandoned:
+            self.close_entry_async(entry)
+
+    def abandon(self, entry):
+        """
+        wait_timeout秒以内に接続できなかった接続を返却してプールから外す
+        (接続完了と同時なら何もしない)
+        """
+        with self.lock:
+            if entry.ready.is_set():
+                return
+            entry.users -= 1
+            if self.entries.get(entry.key) is entry:
+                del self.entries[entry.key]
+            self.lock.notify_all()
+        logger.warning("------Session timed out(PaperoPool.acquire()) : " + str(entry.key))
+        raise ConnectionError("robot session timed out")
+
+    def release(self, entry):
+        """
+        接続を返却
+        @param entry:acquire()の戻り値
+        """
+        with self.lock:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            self.lock.notify_all()
+
+    def remove(self, simulator_id, robot_name=""):
+        """
+        接続をプールから外す(切断は呼び出し側で行う)
+        @return 外したPapero(無ければNone)
+        """
+        with self.lock:
+            entry = self.entries.pop((simulator_id, robot_name), None)
+            self.lock.notify_all()
+        if entry is None:
+            return None
+        return entry.papero
+
+    def end(self, simulator_id, robot_name="", before=None):
+        """
+        接続をプールから外し、終了処理をバックグラウンドで開始する
+        @param before:終了処理の前に呼ぶ関数(例:operation.bye)
+        @return TeardownHandle(接続が無ければNone)
+        """
+        papero = self.remove(simulator_id, robot_name)
+        if papero is None:
+            return None
+        return self.teardown.submit((simulator_id, robot_name), papero, before)
+
+    def remove_entry(self, entry):
+        """
+        @return プールから外した場合True(既に外されていればFalse)
+        """
+        with self.lock:
+            removed = self.entries.get(entry.key) is entry
+            if removed:
+                del self.entries[entry.key]
+            self.lock.notify_all()
+        return removed
+
+    def sessions(self):
+        """
+        @return (キー, Papero)のリスト
+        """
+        with self.lock:
+            return [(key, entry.papero) for key, entry in self.entries.items()
+                    if entry.papero is not None]
+
+    def close_all(self):
+        """
+        全接続を切断
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        handles = [self.close_entry_async(entry) for entry in entries]
+        for handle in handles:
+            if handle is not None:
+                handle.wait()
+
+    def evict_idle_locked(self):
+        """
+        TTLを過ぎた未使用接続を切断(ロック内で呼ぶ)
+        """
+        now = time.monotonic()
+        for key, entry in list(self.entries.items()):
+            if (entry.users == 0) and entry.ready.is_set() \
+                    and ((now - entry.last_used > self.idle_ttl) or not entry.is_healthy()):
+                del self.entries[key]
+                self.close_entry_async(entry)
+
+    def make_room_locked(self, deadline):
+        """
+        上限に達していれば最も長く未使用の接続を切断する(ロック内で呼ぶ)
+        @return 空きができた場合True
+        """
+        while not self.evict_lru_locked():
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                return False
+            self.lock.wait(remain)
+        return True
+
+    def evict_lru_locked(self):
+        """
+        上限に達していれば使用中でない接続を古い順に切断する(ロック内で呼ぶ、待たない)
+        @return 空きがある場合True
+        """
+        while len(self.entries) >= self.max_sessions:
+            for key, entry in self.entries.items():
+                if (entry.users == 0) and entry.ready.is_set():
+                    del self.entries[key]
+                    self.close_entry_async(entry)
+                    break
+            else:
+                return False
+        return True
+
+    def close_entry_async(self, entry):
+        """
+        切断処理はリクエスト処理を待たせないようTeardownManagerで行う
+        @return TeardownHandle(接続が無ければNone)
+        """
+        if entry.papero is None:
+            return None
+        return self.teardown.submit(entry.key, entry.papero)
+
+
+class AsyncPaperoPool(PaperoPool):
+    """
+    AsyncPapero用の接続プール(イベントループのスレッドからのみ使用する)
+    接続・空き待ちはコルーチンで行い、終了処理はAsyncTeardownManagerで行う。
+        async with pool.session(simulator_id) as papero:
+            operation.hello(papero)
+    """
+
+    def __init__(self, max_sessions=1024, idle_ttl=300.0, ws_server_addr="",
+                 factory=None, wait_timeout=10.0, teardown=None):
+        """
+        @param factory:接続生成コルーチン関数
+                       (Noneならinit_timeoutをwait_timeoutにしたpapero_async.AsyncPapero.create)
+        @param teardown:切断処理を行うAsyncTeardownManager(Noneなら専用に生成)
+        その他の引数はPaperoPoolと同じ
+        """
+        if factory is None:
+            factory = functools.partial(papero_async.AsyncPapero.create, init_timeout=wait_timeout)
+        if teardown is None:
+            teardown = papero_teardown.AsyncTeardownManager()
+        super().__init__(max_sessions, idle_ttl, ws_server_addr, factory, wait_timeout, teardown)
+        self.changed = None  # 接続の返却・削除を通知するasyncio.Event
+
+    @contextlib.asynccontextmanager
+    async def session(self, simulator_id, robot_name=""):
+        """
+        接続を借りる(async withブロックの間は切断されない)
+        """
+        entry = await self.acquire(simulator_id, robot_name)
+        try:
+            yield entry.papero
+        finally:
+            self.release(entry)
+
+    async def acquire(self, simulator_id, robot_name=""):
+        """
+        接続を借りる(release()で返却すること)
+        @return PaperoSession
+        """
+        key = (simulator_id, robot_name)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            creator = False
+            with self.lock:
+                self.evict_idle_locked()
+                entry = self.entries.get(key)
+                if (entry is None) and self.evict_lru_locked():
+                    entry = PaperoSession(key, asyncio.Event())
+                    self.entries[key] = entry
+                    creator = True
+                if entry is not None:
+                    entry.users += 1
+                    entry.last_used = time.monotonic()
+                    self.entries.move_to_end(key)
+            if entry is None:
+                remain = deadline - time.monotonic()
+                if remain <= 0:
+                    raise PaperoPoolFull("too many robot sessions")
+                await self.wait_changed(remain)
+                continue
+            if creator:
+                entry.deadline = time.monotonic() + self.wait_timeout
+                asyncio.ensure_future(self.connect(entry))
+            try:
+                await asyncio.wait_for(entry.ready.wait(), max(0.0, entry.deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self.abandon(entry)
+            if entry.is_healthy():
+                return entry
+            self.release(entry)
+            if self.remove_entry(entry):
+                self.close_entry_async(entry)
+            if creator:
+                raise ConnectionError("robot session could not be opened")
+
+    async def connect(self, entry):
+        simulator_id, robot_name = entry.key
+        try:
+            papero = await self.factory(simulator_id, robot_name, self.ws_server_addr)
+        except Exception:
+            logger.exception("------Error occurred(AsyncPaperoPool.connect())")
+            papero = None
+        self.connected(entry, papero)
+
+    def abandon(self, entry):
+        try:
+            super().abandon(entry)
+        finally:
+            self.notify_changed()
+
+    def release(self, entry):
+        super().release(entry)
+        self.notify_changed()
+
+    def remove(self, simulator_id, robot_name=""):
+        papero = super().remove(simulator_id, robot_name)
+        self.notify_changed()
+        return papero
+
+    def remove_entry(self, entry):
+        removed = super().remove_entry(entry)
+        self.notify_changed()
+        return removed
+
+    async def close_all(self):
+        """
+        全接続を切断
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        handles = [self.close_entry_async(entry) for entry in entries]
+        for handle in handles:
+            if handle is not None:
+                await handle.wait_async()
+
+    def notify_changed(self):
+        if self.changed is not None:
+            self.changed.set()
+            self.changed = None
+
+    async def wait_changed(self, t):
+        """
+        接続の返却・削除をt秒まで待つ
+        """
+        if self.changed is None:
+            self.changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self.changed.wait(), t)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,291 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i センサデータの列指向記録(メモリマップした.npyセグメント)
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import os
+import json
+import time
+import threading
+
+import numpy
+from numpy.lib import format as npy_format
+
+import papero_acc
+import papero_face
+
+INDEX_FILE = "index.json"
+SEGMENT_ROWS = 65536  # 1セグメントの行数
+
+# 記録する受信伝文と列の定義
+#   チャンネル名→(伝文名, [(列名, 伝文の項目名, 型)])
+#   時刻の列("t"、UNIX時刻)は自動で追加する
+CHANNELS = {
+    "acc": (papero_acc.ACC_EVENT, [(axis.lower(), axis, "float32") for axis in papero_acc.ACC_FIELDS]),
+    "lum": ("getLumSensorValueRes", [("value", "Value", "float32")]),
+    "face": ("detectFace", [("x", papero_face.POSITION_FIELD, "float32"), ("y", None, "float32"),
+                            ("eye_distance", papero_face.EYE_DISTANCE_FIELD, "float32")]),
+}
+
+
+def write_json(path, obj):
+    """
+    一時ファイルに書いて置き換える(読み手が書きかけの内容を読まないように)
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class ChannelWriter:
+    """
+    1チャンネル分の書き込み
+    directory/
+        index.json        列の定義とセグメントの一覧(行数・時刻範囲)
+        000000.t.npy      列ごとのセグメント
+        000000.x.npy
+    """
+
+    def __init__(self, directory, columns, segment_rows=SEGMENT_ROWS):
+        """
+        @param directory:チャンネルのディレクトリ
+        @param columns:[(列名, 型)]("t"以外)
+        """
+        self.directory = directory
+        self.columns = [("t", "float64")] + list(columns)
+        self.segment_rows = segment_rows
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.segments = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            if [tuple(c) for c in index["columns"]] != self.columns:
+                raise ValueError("column mismatch in " + self.index_path)
+            self.segments = index["segments"]
+        self.arrays = None  # 書き込み中のセグメント(列名→memmap)
+        self.current = None  # 書き込み中のセグメントの情報
+        self.rows = 0
+
+    def open_segment(self):
+        name = "%06d" % len(self.segments)
+        self.arrays = {}
+        for column, dtype in self.columns:
+            path = os.path.join(self.directory, "%s.%s.npy" % (name, column))
+            self.arrays[column] = npy_format.open_memmap(path, mode="w+", dtype=dtype, shape=(self.segment_rows,))
+        self.current = {"name": name, "rows": 0, "start": None, "end": None}
+        self.segments.append(self.current)
+        self.rows = 0
+
+    def append(self, times, values):
+        """
+        @param times:時刻(UNIX時刻)の配列
+        @param values:列名→配列
+        """
+        n = len(times)
+        done = 0
+        with self.lock:
+            if (len(self.segments) > 0) and (self.segments[-1]["end"] is not None):
+                # 読み出し時に二分探索できるよう時刻を単調にする
+                times = numpy.maximum(times, self.segments[-1]["end"])
+            while done < n:
+                if (self.arrays is None) or (self.rows >= self.segment_rows):
+                    self.close_segment()
+                    self.open_segment()
+                count = min(n - done, self.segment_rows - self.rows)
+                rows = slice(self.rows, self.rows + count)
+                self.arrays["t"][rows] = times[done:done + count]
+                for column, dtype in self.columns[1:]:
+                    self.arrays[column][rows] = values[column][done:done + count]
+                if self.current["start"] is None:
+                    self.current["start"] = float(times[done])
+                self.current["end"] = float(times[done + count - 1])
+                self.rows += count
+                self.current["rows"] = self.rows
+                done += count
+
+    def flush(self):
+        """
+        書き込み中のセグメントと索引をファイルに反映
+        """
+        with self.lock:
+            if self.arrays is not None:
+                for array in self.arrays.values():
+                    array.flush()
+            write_json(self.index_path, {"columns": self.columns, "segments": self.segments})
+
+    def close_segment(self):
+        if self.arrays is None:
+            return
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = None
+        write_json(self.index_path, {"columns": self.columns, "segments": self.segments})
+
+    def close(self):
+        with self.lock:
+            self.close_segment()
+
+
+class SensorRecorder:
+    """
+    受信したセンサデータをチャンネルごとに列指向で記録する
+        recorder = SensorRecorder("rec", papero)
+        recorder.record("acc")
+        recorder.record("lum")
+        ...
+        recorder.close()
+    """
+
+    def __init__(self, directory, papero=None, segment_rows=SEGMENT_ROWS, flush_interval=5.0):
+        """
+        @param directory:記録先ディレクトリ
+        @param papero:Papero(record()で購読する)
+        @param segment_rows:1セグメントの行数
+        @param flush_interval:索引を更新する間隔(秒)
+        """
+        self.directory = directory
+        self.papero = papero
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self.flushed = time.monotonic()
+        self.writers = {}
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    def channel(self, name, columns):
+        """
+        @param name:チャンネル名
+        @param columns:[(列名, 型)]
+        @return ChannelWriter
+        """
+        with self.lock:
+            writer = self.writers.get(name)
+            if writer is None:
+                writer = ChannelWriter(os.path.join(self.directory, name), columns, self.segment_rows)
+                self.writers[name] = writer
+            return writer
+
+    def append(self, name, times, values):
+        """
+        @param name:チャンネル名(channel()で作成済みのもの)
+        @param times:時刻(UNIX時刻)の配列
+        @param values:列名→配列
+        """
+        self.writers[name].append(times, values)
+        now = time.monotonic()
+        if now - self.flushed >= self.flush_interval:
+            self.flushed = now
+            self.flush()
+
+    def record(self, name, pattern=None, fields=None, rate=None):
+        """
+        受信伝文をチャンネルに記録する
+        @param name:チャンネル名(CHANNELSにあればpattern・fieldsは省略可)
+        @param pattern:伝文名
+        @param fields:[(列名, 伝文の項目名, 型)] 値が"(x,y)"形式なら次の項目名Noneの列に2つ目の値を入れる
+                      値がカンマ区切りの場合は複数行として記録する
+        @param rate:1伝文に複数行ある場合のサンプリング周波数(Hz)
+        @return 購読ハンドル
+        """
+        if name in CHANNELS:
+            pattern = pattern or CHANNELS[name][0]
+            fields = fields or CHANNELS[name][1]
+        self.channel(name, [(column, dtype) for column, field, dtype in fields])
+        if rate is None:
+            rate = papero_acc.DATA_RATES[9]
+
+        def on_message(message):
+            try:
+                values = {}
+                n = None
+                for i, (column, field, dtype) in enumerate(fields):
+                    if field is None:
+                        continue
+                    numbers = papero_face.parse_numbers([str(message[field])], dtype)
+                    if (i + 1 < len(fields)) and (fields[i + 1][1] is None):
+                        values[column] = numbers[0::2]
+                        values[fields[i + 1][0]] = numbers[1::2]
+                    else:
+                        values[column] = numbers
+                    n = len(values[column]) if n is None else min(n, len(values[column]))
+            except (KeyError, ValueError):
+                logger.warning("------Invalid sensor data(" + name + ") : " + str(message))
+                return
+            now = time.time()
+            self.append(name, now - numpy.arange(n - 1, -1, -1) / rate,
+                        {column: v[:n] for column, v in values.items()})
+
+        subscription = self.papero.on(pattern, on_message)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def flush(self):
+        for writer in list(self.writers.values()):
+            writer.flush()
+
+    def close(self):
+        for subscription in self.subscriptions:
+            self.papero.off(subscription)
+        self.subscriptions = []
+        for writer in list(self.writers.values()):
+            writer.close()
+
+
+class SensorReader:
+    """
+    SensorRecorderの記録の読み出し(必要なセグメントだけをメモリマップする)
+        reader = SensorReader("rec")
+        data = reader.read("acc", start, end)
+        data["t"], data["x"], ...
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def channels(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.exists(os.path.join(self.directory, name, INDEX_FILE)))
+
+    def index(self, name):
+        with open(os.path.join(self.directory, name, INDEX_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    def read(self, name, start=None, end=None, columns=None):
+        """
+        @param name:チャンネル名
+        @param start:開始時刻(UNIX時刻、Noneなら最初から)
+        @param end:終了時刻(この時刻を含まない、Noneなら最後まで)
+        @param columns:列名のリスト(Noneなら全列)
+        @return 列名→配列
+        """
+        index = self.index(name)
+        if columns is None:
+            columns = [column for column, dtype in index["columns"]]
+        parts = {column: [] for column in columns}
+        for segment in index["segments"]:
+            rows = segment["rows"]
+            if (rows == 0) or ((start is not None) and (segment["end"] < start)) \
+                    or ((end is not None) and (segment["start"] >= end)):
+                continue
+            t = self.column(name, segment, "t")[:rows]
+            lo = 0 if start is None else numpy.searchsorted(t, start, side="left")
+            hi = rows if end is None else numpy.searchsorted(t, end, side="left")
+            for column in columns:
+                # スライスしてからコピーするので範囲外は読み込まない
+                parts[column].append(numpy.array(self.column(name, segment, column)[lo:hi]))
+        rtn = {}
+        for column, dtype in index["columns"]:
+            if column in parts:
+                rtn[column] = numpy.concatenate(parts[column]) if len(parts[column]) > 0 \
+                    else numpy.zeros(0, dtype=dtype)
+        return rtn
+
+    def column(self, name, segment, column):
+        return numpy.load(os.path.join(self.directory, name, "%s.%s.npy" % (segment["name"], column)),
+                          mmap_mode="r")
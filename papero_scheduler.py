@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i コマンド送信スケジューラ
+# ライセンス：MIT
+##############################################################
+import collections
+
+HIGHER = "higher"
+NORMAL = "normal"
+
+# 送信先(Destination)→(1秒あたりのコマンド数, バースト数)
+# ここにない送信先は制限しない
+DESTINATION_RATES = {
+    "MotorController": (10.0, 3),
+    "LEDController": (20.0, 5),
+    "SpeechSynthesizer": (4.0, 2),
+}
+
+
+class CommandSuperseded(Exception):
+    """
+    送信待ちのコマンドが後から送信された同種のコマンドに置き換えられた
+    """
+
+    def __init__(self, message_id, superseded_by):
+        super().__init__("command " + str(message_id) + " superseded by " + str(superseded_by))
+        self.message_id = message_id
+        self.superseded_by = superseded_by
+
+
+def supersede_key(message):
+    """
+    後から送信されたコマンドで置き換えてよいコマンドのキー
+    ・moveHead → 頭部
+    ・turnLedOn/turnLedOff → 部位(Part)ごと
+    @param message:コマンド辞書
+    @return キー(置き換え対象外ならNone)
+    """
+    name = message.get("Name")
+    if name == "moveHead":
+        return ("head", message.get("Destination"))
+    if name in ("turnLedOn", "turnLedOff"):
+        return ("led", message.get("Part"))
+    return None
+
+
+class RateLimiter:
+    """
+    トークンバケット
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = None
+
+    def refill(self, now):
+        if self.last is not None:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, now):
+        """
+        @return トークンを1つ取得できた場合True
+        """
+        self.refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def next_time(self, now):
+        """
+        @return 次にトークンを取得できる時刻
+        """
+        self.refill(now)
+        return now + max(0.0, (1.0 - self.tokens) / self.rate)
+
+
+class OutboundScheduler:
+    """
+    優先度・送信先ごとの流量制限・置き換えを行う送信待ちキュー(排他制御なし)
+    """
+
+    def __init__(self, rates=None):
+        if rates is None:
+            rates = DESTINATION_RATES
+        self.limiters = {dest: RateLimiter(rate, burst) for dest, (rate, burst) in rates.items()}
+        self.queues = {HIGHER: collections.deque(), NORMAL: collections.deque()}  # [コマンド, 有効]
+        self.superseding = {}  # supersede_key→エントリ
+        self.superseded = 0
+
+    def push(self, message):
+        """
+        @param message:コマンド辞書
+        @return 置き換えられたコマンド(なければNone)
+        """
+        priority = HIGHER if message.get("Priority") == HIGHER else NORMAL
+        key = supersede_key(message)
+        old = None
+        if key is not None:
+            entry = self.superseding.get(key)
+            if (entry is not None) and entry[1]:
+                old = entry[0]
+                self.superseded += 1
+                if entry[2] == priority:
+                    # 同じ優先度なら順番はそのままで中身だけ置き換える
+                    entry[0] = message
+                    return old
+                entry[1] = False
+        entry = [message, True, priority]
+        self.queues[priority].append(entry)
+        if key is not None:
+            self.superseding[key] = entry
+        return old
+
+    def pop_ready(self, now, limit):
+        """
+        送信してよいコマンドを取り出す(優先度順、同じ送信先の中では到着順)
+        @param now:現在時刻(time.monotonic())
+        @param limit:取り出す最大数
+        @return コマンドのリスト
+        """
+        rtn = []
+        blocked = set()
+        for priority in (HIGHER, NORMAL):
+            queue = self.queues[priority]
+            kept = collections.deque()
+            while len(queue) > 0:
+                entry = queue.popleft()
+                if not entry[1]:
+                    continue
+                if len(rtn) >= limit:
+                    kept.append(entry)
+                    kept.extend(queue)
+                    queue.clear()
+                    break
+                destination = entry[0].get("Destination")
+                limiter = self.limiters.get(destination)
+                if (destination in blocked) or ((limiter is not None) and not limiter.take(now)):
+                    blocked.add(destination)
+                    kept.append(entry)
+                    continue
+                self.take(entry)
+                rtn.append(entry[0])
+            self.queues[priority] = kept
+        return rtn
+
+    def next_ready_time(self, now):
+        """
+        @return 次にコマンドを送信できる時刻(送信待ちがなければNone)
+        """
+        rtn = None
+        for queue in self.queues.values():
+            for entry in queue:
+                if not entry[1]:
+                    continue
+                limiter = self.limiters.get(entry[0].get("Destination"))
+                t = now if limiter is None else limiter.next_time(now)
+                if (rtn is None) or (t < rtn):
+                    rtn = t
+        return rtn
+
+    def pop_all(self):
+        """
+        流量制限を無視して送信待ちのコマンドをすべて取り出す
+        @return コマンドのリスト
+        """
+        rtn = []
+        for priority in (HIGHER, NORMAL):
+            for entry in self.queues[priority]:
+                if entry[1]:
+                    self.take(entry)
+                    rtn.append(entry[0])
+            self.queues[priority].clear()
+        return rtn
+
+    def take(self, entry):
+        entry[1] = False
+        key = supersede_key(entry[0])
+        if (key is not None) and (self.superseding.get(key) is entry):
+            del self.superseding[key]
+
+    def __len__(self):
+        return sum(1 for queue in self.queues.values() for entry in queue if entry[1])
@@ -0,0 +1,407 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 状態のミラー(送信コマンドから頭部・LED等の状態を推定し、状態取得をキャッシュする)
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import re
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+import papero_scheduler
+import papero_timeline
+
+HEAD_STEP_PATTERN = re.compile(r"^([AR])(-?\d+)T(\d+)")
+
+# 状態取得関数→送信先(同じ送信先へ状態を変えるコマンドを送るとキャッシュを破棄する)
+STATUS_GETTERS = {
+    "send_get_head_status": "MotorController",
+    "send_get_led_status": "LEDController",
+    "send_get_default_status_led": "LEDController",
+    "send_get_speech_status": "SpeechSynthesizer",
+    "send_get_default_status_speech": "SpeechSynthesizer",
+    "send_get_playing_status": "WavePlayer",
+    "send_get_default_status_wavplay": "WavePlayer",
+    "send_get_default_status_wavrec": "WaveRecorder",
+    "send_get_camera_status": "VideoCapture",
+}
+# 送信先→状態取得結果の有効期間(秒)
+STATUS_TTLS = {
+    "MotorController": 0.5,
+    "LEDController": 1.0,
+    "SpeechSynthesizer": 0.5,
+    "WavePlayer": 1.0,
+    "WaveRecorder": 5.0,
+    "VideoCapture": 5.0,
+}
+QUERY_TIMEOUT = 5.0
+# setDefaultStatusの記録から除く共通項目
+COMMON_FIELDS = ("Name", "Type", "Destination", "Source", "Time", "Priority", "MessageID", "Expiration")
+# 状態取得の応答の項目名
+HEAD_STATUS_FIELDS = {"vertical": "Vertical", "horizontal": "Horizontal"}  # 現在の角度
+STATUS_FIELD = "Status"  # getLedStatusRes:"on"/"off"、getPlayingStatusRes:再生中なら"playing"
+RESULT_FIELDS = COMMON_FIELDS + ("Result", "Target")
+
+
+def parse_head_steps(steps):
+    """
+    @param steps:"A-15T500L,R0T500L"形式のシーケンス(カンマ区切り又はリスト)
+    @return (絶対指定ならTrue, 角度, 時間ms)のリスト
+    """
+    if isinstance(steps, str):
+        steps = steps.split(",")
+    rtn = []
+    for step in steps:
+        m = HEAD_STEP_PATTERN.match(step)
+        if m is None:
+            raise ValueError("invalid head step: " + str(step))
+        rtn.append((m.group(1) == "A", int(m.group(2)), int(m.group(3))))
+    return rtn
+
+
+class HeadAxis:
+    """
+    頭部1軸の角度の推定(各ステップの間は直線的に動くとみなす)
+    """
+
+    def __init__(self):
+        self.origin = 0.0  # 動作開始時(停止中は現在)の角度
+        self.start = None  # 動作開始時刻(停止中はNone)
+        self.path = []  # (開始からの秒数, 角度)のリスト
+        self.repeat = False
+
+    def position(self, now):
+        if self.start is None:
+            return self.origin
+        t = now - self.start
+        duration = self.path[-1][0]
+        if self.repeat and (duration > 0):
+            t %= duration
+        prev_t, prev_pos = 0.0, self.origin
+        for end_t, pos in self.path:
+            if t < end_t:
+                return prev_pos + (pos - prev_pos) * (t - prev_t) / (end_t - prev_t)
+            prev_t, prev_pos = end_t, pos
+        return prev_pos
+
+    def moving(self, now):
+        return (self.start is not None) and (self.repeat or (now - self.start < self.path[-1][0]))
+
+    def target(self):
+        """
+        @return 動作終了時の角度(繰り返しの場合は1周期の終わり)
+        """
+        return self.path[-1][1] if self.start is not None else self.origin
+
+    def move(self, now, steps, repeat):
+        """
+        @param steps:parse_head_steps()の戻り値
+        """
+        self.origin = self.position(now)
+        pos = self.origin
+        t = 0.0
+        self.path = []
+        for absolute, angle, ms in steps:
+            pos = float(angle) if absolute else pos + angle
+            t += ms / 1000.0
+            self.path.append((t, pos))
+        self.start = now if len(self.path) > 0 else None
+        self.repeat = repeat
+
+    def stop(self, now, position=None):
+        self.origin = self.position(now) if position is None else position
+        self.start = None
+        self.path = []
+        self.repeat = False
+
+
+class StateMirror:
+    """
+    ロボットの状態のクライアント側の写し
+    ・送信したコマンドから頭部の角度・LED・再生・撮影・既定値を推定する(往復なしで参照できる)
+      コマンドは応答を受け取ってから送信時刻に遡って反映する(置き換え・切断で失敗したものは反映しない)
+    ・状態取得(get*Status)の応答も推定状態に反映する
+    ・状態取得はTTLの間キャッシュし、同じ問い合わせが同時に来たら1回だけ送信する
+    ・状態を変えるコマンドを送る・応答を受け取ると同じ送信先のキャッシュは破棄する
+        mirror = StateMirror(papero)
+        papero.send_move_head(["A-15T500L"], ["A30T500L"])
+        mirror.head_position()  # moveHeadResの受信後は移動中の推定角度(上下, 水平)
+        mirror.query("send_get_speech_status")  # 0.5秒以内の結果があればそれを返す
+    """
+
+    def __init__(self, papero, ttls=None):
+        """
+        @param papero:Papero又はAsyncPapero
+        @param ttls:送信先→状態取得結果の有効期間(秒)(STATUS_TTLSを上書き)
+        """
+        self.papero = papero
+        self.ttls = dict(STATUS_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        # snapshot()の中でled()を呼ぶのでRLock
+        # 送信・応答待ちFutureの完了はロック外で行う(送信側・受信側のロックとの順序の逆転を避ける)
+        self.lock = threading.RLock()
+        self.head = {"vertical": HeadAxis(), "horizontal": HeadAxis()}
+        self.leds = {}  # 部位→LEDの状態
+        self.playing = None  # 再生中のファイル名
+        self.capturing = {}  # カメラ→共有メモリID
+        self.defaults = {}  # 送信先→setDefaultStatusで設定した値
+        self.cache = {}  # (状態取得関数, 引数...)→(取得時刻, 応答)
+        self.inflight = {}  # (状態取得関数, 引数...)→呼び出し元に渡すFuture
+        self.generations = {}  # 送信先→キャッシュ破棄の回数
+        self.stats = {"hits": 0, "misses": 0, "merged": 0}
+        self.subscription = papero.on_sent("*", self.on_sent)
+
+    def close(self):
+        self.papero.off(self.subscription)
+
+    def on_sent(self, message):
+        """
+        送信コマンドの応答待ちを登録(send_*を呼んだスレッド)
+        """
+        name = message.get("Name", "")
+        destination = message.get("Destination")
+        if name.startswith("get"):
+            return
+        now = time.monotonic()
+        self.invalidate(destination)
+        if "MessageID" not in message:
+            self.apply(message, now)
+            return
+        future = self.papero.papero_response_future(message["MessageID"])
+        future.add_done_callback(lambda f: self.on_done(message, now, f))
+
+    def on_done(self, message, sent, future):
+        """
+        応答を受け取ったコマンドを状態に反映(受信スレッド)
+        @param sent:送信時刻
+        """
+        if (not future.cancelled()) and (future.exception() is None):
+            self.apply(message, sent)
+        else:
+            logger.debug("------Command not applied(StateMirror.on_done()) : " + str(message.get("Name")))
+        # 応答までの間に取得した状態は古い(発話の終了なども含む)
+        self.invalidate(message.get("Destination"))
+
+    def apply(self, message, now):
+        """
+        コマンドを状態に反映
+        @param now:動作開始時刻
+        """
+        name = message.get("Name", "")
+        destination = message.get("Destination")
+        with self.lock:
+            if name == "moveHead":
+                repeat = message.get("Repeat") == "true"
+                self.head["vertical"].move(now, parse_head_steps(message["Vertical"]), repeat)
+                self.head["horizontal"].move(now, parse_head_steps(message["Horizontal"]), repeat)
+            elif name == "stopHead":
+                for axis in self.head.values():
+                    axis.stop(now)
+            elif name == "resetHead":
+                for axis in self.head.values():
+                    axis.stop(now, 0.0)
+            elif name == "turnLedOn":
+                pattern = message["Pattern"].split(",")
+                repeat = message.get("Repeat") == "true"
+                self.leds[message["Part"]] = {
+                    "on": True, "pattern": pattern, "repeat": repeat, "since": now,
+                    "until": None if repeat else now + papero_timeline.led_frames_ms(pattern) / 1000.0}
+            elif name == "turnLedOff":
+                self.leds[message["Part"]] = {"on": False, "pattern": None, "repeat": False, "since": now,
+                                              "until": None}
+            elif name == "startPlaying":
+                self.playing = message.get("Filename")
+            elif name == "stopPlaying":
+                self.playing = None
+            elif name == "startCapturing":
+                self.capturing[message.get("Camera")] = message.get("ShareMemID")
+            elif name == "stopCapturing":
+                self.capturing.pop(message.get("Camera"), None)
+            elif name == "setDefaultStatus":
+                values = {k: v for k, v in message.items() if k not in COMMON_FIELDS}
+                self.defaults.setdefault(destination, {}).update(values)
+
+    def fold(self, getter, args, response, now):
+        """
+        状態取得の応答を推定状態に反映(ロック内で呼ぶ)
+        """
+        if getter == "send_get_head_status":
+            for axis_name, field in HEAD_STATUS_FIELDS.items():
+                axis = self.head[axis_name]
+                # 移動中は送信時刻からの推定を優先する
+                if (field in response) and not axis.moving(now):
+                    try:
+                        axis.stop(now, float(response[field]))
+                    except ValueError:
+                        pass
+        elif (getter == "send_get_led_status") and (STATUS_FIELD in response):
+            part = args[0]
+            state = self.leds.get(part)
+            on = response[STATUS_FIELD] == "on"
+            if (state is None) or (state["on"] != on):
+                self.leds[part] = {"on": on, "pattern": None, "repeat": False, "since": now, "until": None}
+        elif (getter == "send_get_playing_status") and (STATUS_FIELD in response):
+            if response[STATUS_FIELD] != "playing":
+                self.playing = None
+        elif getter.startswith("send_get_default_status_"):
+            values = {k: v for k, v in response.items() if k not in RESULT_FIELDS}
+            self.defaults.setdefault(STATUS_GETTERS[getter], {}).update(values)
+
+    def invalidate(self, destination):
+        """
+        送信先の状態取得のキャッシュを破棄
+        """
+        with self.lock:
+            self.generations[destination] = self.generations.get(destination, 0) + 1
+            for key in [key for key in self.cache if STATUS_GETTERS[key[0]] == destination]:
+                del self.cache[key]
+
+    def head_position(self, now=None):
+        """
+        @return 推定した頭部の角度(上下, 水平)
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            return self.head["vertical"].position(now), self.head["horizontal"].position(now)
+
+    def head_moving(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            return any(axis.moving(now) for axis in self.head.values())
+
+    def led(self, part):
+        """
+        @return {"on":点灯指示中, "pattern":パターン, "repeat":繰り返し, "active":パターン再生中}(不明ならNone)
+        """
+        now = time.monotonic()
+        with self.lock:
+            state = self.leds.get(part)
+            if state is None:
+                return None
+            rtn = {k: state[k] for k in ("on", "pattern", "repeat")}
+            rtn["active"] = state["on"] and ((state["until"] is None) or (now < state["until"]))
+            return rtn
+
+    def speaking(self):
+        """
+        @return このクライアントが送った発話が終わっていなければTrue
+        """
+        return self.papero.remain_speech_count > 0
+
+    def snapshot(self):
+        """
+        @return 推定状態の辞書(UI向け)
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "head": {"vertical": self.head["vertical"].position(now),
+                         "horizontal": self.head["horizontal"].position(now),
+                         "moving": any(axis.moving(now) for axis in self.head.values())},
+                "leds": {part: self.led(part) for part in self.leds},
+                "speaking": self.speaking(),
+                "playing": self.playing,
+                "capturing": dict(self.capturing),
+                "defaults": {k: dict(v) for k, v in self.defaults.items()},
+            }
+
+    def request(self, getter, args, ttl):
+        """
+        状態取得(キャッシュがあれば結果、なければ応答を受け取るFutureを返す)
+        @return (応答, None)又は(None, Future)
+        """
+        key = (getter,) + tuple(args)
+        destination = STATUS_GETTERS[getter]
+        if ttl is None:
+            ttl = self.ttls.get(destination, 0.0)
+        with self.lock:
+            cached = self.cache.get(key)
+            if (cached is not None) and (time.monotonic() - cached[0] <= ttl):
+                self.stats["hits"] += 1
+                return cached[1], None
+            slot = self.inflight.get(key)
+            if slot is not None:
+                self.stats["merged"] += 1
+                return None, slot
+            self.stats["misses"] += 1
+            generation = self.generations.get(destination, 0)
+            # 送信はロック外で行うので、同じ問い合わせが合流できるよう先に枠を確保する
+            slot = concurrent.futures.Future()
+            self.inflight[key] = slot
+        try:
+            future = self.papero.papero_response_future(getattr(self.papero, getter)(*args))
+        except Exception as e:
+            with self.lock:
+                if self.inflight.get(key) is slot:
+                    del self.inflight[key]
+            settle(slot, e)
+            raise
+        future.add_done_callback(lambda f: self.store(key, destination, generation, slot, f))
+        return None, slot
+
+    def store(self, key, destination, generation, slot, future):
+        """
+        応答をキャッシュし、待っている呼び出し元に渡す
+        """
+        if future.cancelled():
+            exc = concurrent.futures.CancelledError()
+        else:
+            exc = future.exception()
+        with self.lock:
+            if self.inflight.get(key) is slot:
+                del self.inflight[key]
+            # 問い合わせ中に状態を変えるコマンドを送っていれば古い結果なのでキャッシュしない
+            if (exc is None) and (self.generations.get(destination, 0) == generation):
+                now = time.monotonic()
+                self.cache[key] = (now, future.result())
+                self.fold(key[0], key[1:], future.result(), now)
+        settle(slot, exc, future.result() if exc is None else None)
+
+    def query(self, getter, *args, ttl=None, timeout=QUERY_TIMEOUT):
+        """
+        状態取得(Papero用)
+            mirror.query("send_get_led_status", "mouth")
+        @param getter:STATUS_GETTERSの関数名
+        @param args:関数の引数
+        @param ttl:許容する古さ(秒、Noneなら送信先ごとの既定値)
+        @return 応答伝文(辞書)、timeout秒以内に受信できなかった場合はNone
+        """
+        response, future = self.request(getter, args, ttl)
+        if future is None:
+            return response
+        try:
+            return future.result(timeout=timeout)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError, ConnectionError,
+                papero_scheduler.CommandSuperseded):
+            return None
+
+    async def query_async(self, getter, *args, ttl=None, timeout=QUERY_TIMEOUT):
+        """
+        状態取得(AsyncPapero用)
+        """
+        response, future = self.request(getter, args, ttl)
+        if future is None:
+            return response
+        try:
+            # 待ち合わせている他の呼び出し元があるので共有のFutureはキャンセルしない
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError, papero_scheduler.CommandSuperseded):
+            return None
+
+
+def settle(future, exc, result=None):
+    """
+    Futureに結果を設定する(キャンセル済みなら何もしない)
+    """
+    if future.set_running_or_notify_cancel():
+        if exc is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exc)
@@ -0,0 +1,223 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 終了処理のバックグラウンド実行
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import threading
+import time
+import asyncio
+import itertools
+import collections
+import concurrent.futures
+
+
+class TeardownHandle:
+    """
+    1接続分の終了処理の状態
+    state:"pending"(待ち)→"running"(実行中)→"done"(完了)又は"failed"(失敗)
+    """
+
+    def __init__(self, handle_id, key):
+        self.id = handle_id
+        self.key = key
+        self.state = "pending"
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def is_done(self):
+        return self.event.is_set()
+
+    def wait(self, t=None):
+        """
+        終了処理の完了待ち
+        @param t:タイムアウト(Noneの場合は完了までブロック)
+        @return 完了した場合True
+        """
+        return self.event.wait(t)
+
+    async def wait_async(self, t=None):
+        """
+        終了処理の完了待ち(イベントループのスレッドで使用する)
+        @param t:タイムアウト(Noneの場合は完了まで待つ)
+        @return 完了した場合True
+        """
+        if self.event.is_set():
+            return True
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def done(handle):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        self.add_done_callback(done)
+        try:
+            return await asyncio.wait_for(future, t)
+        except asyncio.TimeoutError:
+            return False
+
+    def add_done_callback(self, fn):
+        """
+        完了時に fn(handle) を呼ぶ(完了済みなら即座に呼ぶ)
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def finish(self, state, error=None):
+        with self.lock:
+            self.state = state
+            self.error = error
+            self.finished = time.time()
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception("------Error occurred(TeardownHandle callback)")
+
+    def to_dict(self):
+        """
+        @return JSON化できる状態の辞書
+        """
+        return {"id": self.id,
+                "simulator": self.key[0],
+                "robot": self.key[1],
+                "state": self.state,
+                "error": self.error,
+                "created": self.created,
+                "finished": self.finished}
+
+
+class TeardownManager:
+    """
+    終了処理(bye、papero_cleanup)をワーカースレッドで実行する
+        handle = teardown.submit(key, papero, operation.bye)
+        handle.wait(10.0)
+    """
+
+    def __init__(self, max_workers=4, history_size=256):
+        """
+        @param max_workers:同時に実行する終了処理の数
+        @param history_size:完了したハンドルを保持する数
+        """
+        self.max_workers = max_workers
+        self.executor = None  # 最初の終了処理で生成する
+        self.history_size = history_size
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.handles = collections.OrderedDict()  # id→TeardownHandle
+        self.active = {}  # key→実行中のTeardownHandle
+
+    def submit(self, key, papero, before=None):
+        """
+        終了処理を登録してすぐに戻る
+        @param key:(シミュレータID, ロボット名)
+        @param papero:終了するPaperoインスタンス
+        @param before:終了処理の前に呼ぶ関数(例:operation.bye)
+        @return TeardownHandle(同じ接続の終了処理が実行中ならそのハンドル)
+        """
+        with self.lock:
+            handle = self.active.get(key)
+            if handle is not None:
+                return handle
+            handle = TeardownHandle(str(next(self.ids)), key)
+            self.active[key] = handle
+            self.handles[handle.id] = handle
+            while len(self.handles) > self.history_size:
+                oldest_id, oldest = next(iter(self.handles.items()))
+                if not oldest.is_done():
+                    break
+                del self.handles[oldest_id]
+        self.start(handle, papero, before)
+        return handle
+
+    def start(self, handle, papero, before):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+            executor = self.executor
+        executor.submit(self.run, handle, papero, before)
+
+    def get(self, handle_id):
+        """
+        @return TeardownHandle(無ければNone)
+        """
+        with self.lock:
+            return self.handles.get(str(handle_id))
+
+    def run(self, handle, papero, before):
+        handle.state = "running"
+        try:
+            if before is not None:
+                before(papero)
+            if papero.ws is not None:
+                papero.papero_cleanup()
+        except Exception as e:
+            logger.exception("------Error occurred(TeardownManager.run())")
+            state, error = "failed", str(e)
+        else:
+            state, error = "done", None
+        self.finish(handle, state, error)
+
+    def finish(self, handle, state, error):
+        with self.lock:
+            if self.active.get(handle.key) is handle:
+                del self.active[handle.key]
+        handle.finish(state, error)
+
+    def shutdown(self, wait=True):
+        """
+        実行中の終了処理の完了を待って停止
+        """
+        with self.lock:
+            executor = self.executor
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class AsyncTeardownManager(TeardownManager):
+    """
+    終了処理(bye、papero_cleanup)をイベントループ上のタスクで実行する(AsyncPapero用)
+    beforeはコルーチン関数(例:operation.bye_async)
+        handle = teardown.submit(key, papero, operation.bye_async)
+        await handle.wait_async(10.0)
+    """
+
+    def __init__(self, max_workers=64, history_size=256):
+        """
+        @param max_workers:同時に実行する終了処理の数
+        @param history_size:完了したハンドルを保持する数
+        """
+        super().__init__(max_workers, history_size)
+        self.semaphore = None  # 使用するイベントループ上で生成する
+
+    def start(self, handle, papero, before):
+        asyncio.ensure_future(self.run_async(handle, papero, before))
+
+    async def run_async(self, handle, papero, before):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_workers)
+        async with self.semaphore:
+            handle.state = "running"
+            try:
+                if before is not None:
+                    await before(papero)
+                if papero.ws is not None:
+                    await papero.papero_cleanup()
+            except Exception as e:
+                logger.exception("------Error occurred(AsyncTeardownManager.run_async())")
+                state, error = "failed", str(e)
+            else:
+                state, error = "done", None
+        self.finish(handle, state, error)
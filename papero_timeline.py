@@ -0,0 +1,365 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 振り付けタイムライン
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import re
+import time
+import heapq
+import threading
+
+import pypapero
+
+P = pypapero.Papero
+
+LED_SLOT_MS = 100  # LEDパターンの時間1単位(ms)
+SPEECH_MS_PER_CHAR = 150  # 発話時間の見積もり(1文字あたりms)
+HEAD_MAX_STEPS = 64  # moveHeadの1軸あたりのシーケンス数上限
+LED_MAX_FRAMES = 26  # turnLedOnのパターン数上限
+
+HEAD_STEP_PATTERN = re.compile(r"^[AR](-?\d+)T(\d+)")
+LED_CODE_PATTERN = re.compile(r"[A-Z]\d?")
+
+
+def head_steps_ms(steps):
+    """
+    頭部シーケンスの所要時間
+    @param steps:"A-15T500L"形式のパターンのリスト
+    @return ms
+    """
+    total = 0
+    for step in steps:
+        m = HEAD_STEP_PATTERN.match(step)
+        if m is None:
+            raise ValueError("invalid head step: " + str(step))
+        total += int(m.group(2))
+    return total
+
+
+def led_frames_ms(pattern):
+    """
+    LEDパターンの所要時間
+    @param pattern:[パターン, 時間, パターン, 時間, ...]
+    @return ms
+    """
+    return sum(int(t) for t in pattern[1::2]) * LED_SLOT_MS
+
+
+def speech_ms(text):
+    """
+    発話時間の見積もり
+    """
+    return len(text.strip()) * SPEECH_MS_PER_CHAR
+
+
+def head_step_ends(steps):
+    """
+    @return 各ステップの終了時刻(区間の開始からのms)のリスト
+    """
+    ends = []
+    total = 0
+    for step in steps:
+        total += head_steps_ms([step])
+        ends.append(total)
+    return ends
+
+
+def split_head(at, vertical, horizontal):
+    """
+    シーケンス数の上限を超える頭部区間を、両軸のステップの区切りが揃う時刻で連続する区間に分割する
+    @return (開始ms, 上下, 水平)のリスト
+    """
+    if (len(vertical) <= HEAD_MAX_STEPS) and (len(horizontal) <= HEAD_MAX_STEPS):
+        return [(at, vertical, horizontal)]
+    # 短い方の軸は静止で埋めて両軸の長さを揃える(途中で軸が空にならないように)
+    gap = head_steps_ms(vertical) - head_steps_ms(horizontal)
+    if gap > 0:
+        horizontal = horizontal + ["R0T%dL" % gap]
+    elif gap < 0:
+        vertical = vertical + ["R0T%dL" % -gap]
+    rtn = []
+    while (len(vertical) > HEAD_MAX_STEPS) or (len(horizontal) > HEAD_MAX_STEPS):
+        ends_v = head_step_ends(vertical[:HEAD_MAX_STEPS])
+        ends_h = head_step_ends(horizontal[:HEAD_MAX_STEPS])
+        common = [t for t in set(ends_v) & set(ends_h) if t > 0]
+        if len(common) == 0:
+            raise ValueError("head segment at " + str(at) + "ms cannot be split: no common step boundary within "
+                             + str(HEAD_MAX_STEPS) + " steps")
+        cut = max(common)
+        n_v = len(ends_v) - ends_v[::-1].index(cut)
+        n_h = len(ends_h) - ends_h[::-1].index(cut)
+        rtn.append((at, vertical[:n_v], horizontal[:n_h]))
+        at += cut
+        vertical = vertical[n_v:]
+        horizontal = horizontal[n_h:]
+    rtn.append((at, vertical, horizontal))
+    return rtn
+
+
+def split_led(at, pattern):
+    """
+    パターン数の上限を超えるLED区間を連続する区間に分割する
+    @return (開始ms, パターン)のリスト
+    """
+    rtn = []
+    while len(pattern) // 2 > LED_MAX_FRAMES:
+        head = pattern[:LED_MAX_FRAMES * 2]
+        rtn.append((at, head))
+        at += led_frames_ms(head)
+        pattern = pattern[LED_MAX_FRAMES * 2:]
+    rtn.append((at, pattern))
+    return rtn
+
+
+def led_off_frame(frame):
+    """
+    同じLED数の消灯パターン("NNG3G3NN"→"NNNN")
+    """
+    return "N" * len(LED_CODE_PATTERN.findall(frame))
+
+
+def message_duration(message):
+    """
+    コマンド辞書から動作時間を見積もる
+    @param message:send_*で組み立てたコマンド辞書(CommandTemplate.fieldsなど)
+    @return 秒(時間を持たないコマンドは0.0)
+    """
+    name = message.get("Name")
+    if name == "moveHead":
+        return max(head_steps_ms(message["Vertical"].split(",")),
+                   head_steps_ms(message["Horizontal"].split(","))) / 1000.0
+    if name == "turnLedOn":
+        return led_frames_ms(message["Pattern"].split(",")) / 1000.0
+    if name == "startSpeech":
+        return speech_ms(message["Text"]) / 1000.0
+    return 0.0
+
+
+class CompiledTimeline:
+    """
+    コンパイル済みタイムライン
+    cues:(開始からの秒数, CommandTemplateのリスト)のリスト(時刻順)
+    """
+
+    def __init__(self, name, cues, duration):
+        self.name = name
+        self.cues = cues
+        self.duration = duration
+
+    def commands(self):
+        return sum(len(templates) for at, templates in self.cues)
+
+
+class Timeline:
+    """
+    頭部・LED・発話・モーションを1つの時間軸(ms)で記述する
+        t = Timeline("hello")
+        t.head(0, ["A-15T500L", "A0T500L"], ["A0T500L", "R0T500L"])
+        t.led(0, "mouth", ["NNNG3G3G3NNN", "2", "NNG3NG3NG3NN", "2"])
+        t.speech(200, "こんにちは")
+        compiled = t.compile()
+    同じトラック(頭部、LEDの部位ごと)の区間は重なってはならない。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.heads = []  # (開始ms, 上下, 水平)
+        self.leds = {}  # 部位→[(開始ms, パターン)]
+        self.others = []  # (開始ms, 所要ms, 送信関数, 引数, キーワード引数)
+
+    def head(self, at, vertical, horizontal):
+        """
+        @param at:開始時刻(ms)
+        @param vertical:上下シーケンス
+        @param horizontal:水平シーケンス
+        """
+        self.heads.append((at, list(vertical), list(horizontal)))
+        return self
+
+    def led(self, at, part, pattern):
+        """
+        @param at:開始時刻(ms、LED_SLOT_MSの倍数)
+        @param part:"ear"、"forehead"、"cheek"、"mouth"、"chest"のいずれか
+        @param pattern:[パターン, 時間, ...](send_turn_led_onと同じ)
+        """
+        if at % LED_SLOT_MS != 0:
+            raise ValueError("LED segment must start at a multiple of " + str(LED_SLOT_MS) + "ms: " + str(at))
+        self.leds.setdefault(part, []).append((at, list(pattern)))
+        return self
+
+    def speech(self, at, text, duration=None, **kwargs):
+        """
+        @param duration:発話時間(ms、Noneなら文字数から見積もる)
+        @param kwargs:send_start_speechの引数
+        """
+        if duration is None:
+            duration = speech_ms(text)
+        self.others.append((at, duration, P.send_start_speech, (text,), kwargs))
+        return self
+
+    def motion(self, at, motion_id, duration, sound="None", text=None):
+        """
+        @param duration:モーションの所要時間(ms)
+        """
+        self.others.append((at, duration, P.send_start_motion, (motion_id, sound, text), {}))
+        return self
+
+    def compile(self):
+        """
+        同じトラックの区間は間を静止(R0)又は消灯で埋めて1コマンドにまとめ、
+        シーケンス数の上限を超える場合のみ分割する(1区間で上限を超える場合も連続するコマンドに分割する)
+        @return CompiledTimeline
+        """
+        cues = {}
+        end = 0
+        for at, vertical, horizontal in self.compile_head():
+            cues.setdefault(at, []).append(pypapero.compile_command(P.send_move_head, vertical, horizontal))
+            end = max(end, at + max(head_steps_ms(vertical), head_steps_ms(horizontal)))
+        for part, segments in sorted(self.leds.items()):
+            for at, pattern in self.compile_led(segments):
+                cues.setdefault(at, []).append(pypapero.compile_command(P.send_turn_led_on, part, pattern))
+                end = max(end, at + led_frames_ms(pattern))
+        for at, duration, func, args, kwargs in self.others:
+            cues.setdefault(at, []).append(pypapero.compile_command(func, *args, **kwargs))
+            end = max(end, at + duration)
+        return CompiledTimeline(self.name, [(at / 1000.0, cues[at]) for at in sorted(cues)], end / 1000.0)
+
+    def compile_head(self):
+        """
+        @return (開始ms, 上下, 水平)のリスト
+        """
+        rtn = []
+        heads = []
+        for at, vertical, horizontal in sorted(self.heads, key=lambda h: h[0]):
+            heads.extend(split_head(at, vertical, horizontal))
+        for at, vertical, horizontal in heads:
+            if len(rtn) > 0:
+                start, cur_v, cur_h = rtn[-1]
+                gap_v = at - start - head_steps_ms(cur_v)
+                gap_h = at - start - head_steps_ms(cur_h)
+                if (gap_v < 0) or (gap_h < 0):
+                    raise ValueError("head segments overlap at " + str(at) + "ms")
+                hold_v = ["R0T%dL" % gap_v] if gap_v > 0 else []
+                hold_h = ["R0T%dL" % gap_h] if gap_h > 0 else []
+                if (len(cur_v) + len(hold_v) + len(vertical) <= HEAD_MAX_STEPS) \
+                        and (len(cur_h) + len(hold_h) + len(horizontal) <= HEAD_MAX_STEPS):
+                    cur_v.extend(hold_v + vertical)
+                    cur_h.extend(hold_h + horizontal)
+                    continue
+            rtn.append((at, list(vertical), list(horizontal)))
+        return rtn
+
+    def compile_led(self, segments):
+        """
+        @return (開始ms, パターン)のリスト
+        """
+        rtn = []
+        pieces = []
+        for at, pattern in sorted(segments, key=lambda s: s[0]):
+            pieces.extend(split_led(at, pattern))
+        for at, pattern in pieces:
+            if len(rtn) > 0:
+                start, cur = rtn[-1]
+                gap = at - start - led_frames_ms(cur)
+                if gap < 0:
+                    raise ValueError("LED segments overlap at " + str(at) + "ms")
+                fill = []
+                if gap > 0:
+                    fill = [led_off_frame(cur[-2]), str(gap // LED_SLOT_MS)]
+                if (len(cur) + len(fill) + len(pattern)) // 2 <= LED_MAX_FRAMES:
+                    cur.extend(fill + pattern)
+                    continue
+            rtn.append((at, list(pattern)))
+        return rtn
+
+
+class TimelinePlayer:
+    """
+    タイムラインを時刻どおりに送信する(getHeadStatusで終了を確認しない)
+        player = TimelinePlayer(papero)
+        end = player.play(hello)
+        player.play(ok, start=end)  # helloの終了と同時にokを開始
+        player.wait()
+    """
+
+    def __init__(self, papero, lead=0.0):
+        """
+        @param papero:Papero
+        @param lead:送信を前倒しする秒数(通信遅延分)
+        """
+        self.papero = papero
+        self.lead = lead
+        self.cond = threading.Condition()
+        self.queue = []  # (送信時刻, 連番, CommandTemplateのリスト)
+        self.seq = 0
+        self.end = time.monotonic()
+        self.sending = False
+        self.thread = None
+
+    def play(self, timeline, start=None):
+        """
+        @param timeline:CompiledTimeline(又はcues・durationを持つジェスチャー)
+        @param start:開始時刻(time.monotonic()基準、Noneなら前のタイムラインの終了時と現在の遅い方)
+        @return 終了時刻
+        """
+        now = time.monotonic()
+        if start is None:
+            start = max(now, self.end)
+        with self.cond:
+            for at, templates in timeline.cues:
+                heapq.heappush(self.queue, (start + at - self.lead, self.seq, templates))
+                self.seq += 1
+            self.end = max(self.end, start + timeline.duration)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+        return start + timeline.duration
+
+    def cancel(self):
+        """
+        未送信のコマンドを破棄
+        """
+        with self.cond:
+            self.queue = []
+            self.end = time.monotonic()
+            self.cond.notify_all()
+
+    def wait(self, t=None):
+        """
+        すべてのコマンドの送信待ち
+        @return 送信し終えた場合True
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: (len(self.queue) == 0) and not self.sending, t)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if len(self.queue) == 0:
+                        self.cond.notify_all()
+                        self.cond.wait()
+                        continue
+                    remain = self.queue[0][0] - time.monotonic()
+                    if remain <= 0:
+                        break
+                    self.cond.wait(remain)
+                templates = []
+                due = self.queue[0][0]
+                while (len(self.queue) > 0) and (self.queue[0][0] <= due):
+                    templates.extend(heapq.heappop(self.queue)[2])
+                self.sending = True
+            try:
+                if self.papero.errOccurred == 0:
+                    with self.papero.batch():
+                        for template in templates:
+                            self.papero.send_command_template(template)
+            finally:
+                with self.cond:
+                    self.sending = False
+                    self.cond.notify_all()
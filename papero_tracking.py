@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+##############################################################
+# PaPeRo i 顔追従(detectFace→moveHead)
+# ライセンス：MIT
+##############################################################
+from logging import getLogger
+logger = getLogger(__name__)
+
+import time
+import threading
+
+import papero_face
+import papero_scheduler
+
+# 頭部の可動範囲(度)
+HEAD_LIMITS = {"vertical": (-15, 15), "horizontal": (-60, 60)}
+# カメラの画角(水平, 上下)(度)
+CAMERA_FOV = (60.0, 45.0)
+
+
+class FaceTracker:
+    """
+    detectFaceイベントを受けるたびに顔の方向へ頭を向ける
+        tracker = FaceTracker(papero)
+        tracker.start()
+        ...
+        tracker.stop()
+    ・顔の位置は直近の動きから通信遅延分(lead秒)先を予測する
+    ・moveHeadは最大rate回/秒、送信前に新しいイベントが来たら古い目標は捨てる(キューに溜めない)
+    """
+
+    def __init__(self, papero, image_size=(640, 480), fov=CAMERA_FOV, rate=10.0, lead=0.08,
+                 gain=0.8, deadband=1, window=0.3, signs=(1, 1), limits=HEAD_LIMITS,
+                 position=papero_face.POSITION_FIELD, eye_distance=papero_face.EYE_DISTANCE_FIELD):
+        """
+        @param papero:Papero
+        @param image_size:detectFaceの座標系の大きさ(幅, 高さ)
+        @param fov:カメラの画角(水平, 上下)(度)
+        @param rate:moveHeadの最大送信回数(1秒あたり)
+        @param lead:予測する時間(秒、イベント受信から頭が動き出すまでの遅延)
+        @param gain:ずれに対して1回で動かす割合
+        @param deadband:これ未満のずれ(度)では動かさない
+        @param window:速度を求める期間(秒)
+        @param signs:画像上の+方向に対応する頭部角度の符号(水平, 上下)
+        @param limits:頭部の可動範囲
+        """
+        self.papero = papero
+        self.image_size = image_size
+        self.fov = fov
+        self.interval = 1.0 / rate
+        self.limiter = papero_scheduler.RateLimiter(rate, 1)
+        self.lead = lead
+        self.gain = gain
+        self.deadband = deadband
+        self.window = window
+        self.signs = signs
+        self.limits = limits
+        self.faces = papero_face.FaceWindow(capacity=64, position=position, eye_distance=eye_distance)
+        self.cond = threading.Condition()
+        self.angle = (0, 0)  # 最後に指示した角度(水平, 上下)
+        self.target = None  # 未送信の目標角度(水平, 上下)
+        self.target_time = None  # 目標を求めたイベントの受信時刻
+        self.subscription = None
+        self.thread = None
+        self.running = False
+        self.stats = {"events": 0, "sent": 0, "superseded": 0, "deadband": 0}
+        self.reaction = None  # 最後のイベント受信からmoveHead送信までの秒数
+
+    def start(self, min_eye_distance=None, detect=True):
+        """
+        @param min_eye_distance:send_start_face_detectionの引数
+        @param detect:TrueならstartFaceDetectionを送信する
+        """
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.subscription = self.papero.on("detectFace", self.on_face)
+        if detect:
+            self.papero.send_start_face_detection(min_eye_distance)
+
+    def stop(self, detect=True):
+        """
+        @param detect:TrueならstopFaceDetectionを送信する
+        """
+        if self.subscription is not None:
+            self.papero.off(self.subscription)
+            self.subscription = None
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            self.target = None
+            self.cond.notify_all()
+        self.thread.join()
+        self.thread = None
+        if detect and (self.papero.errOccurred == 0):
+            self.papero.send_stop_face_detection()
+
+    def on_face(self, message):
+        """
+        detectFaceイベントの処理(受信スレッド)
+        """
+        now = time.monotonic()
+        self.faces.append(message, now)
+        batch = self.faces.batch(self.window)
+        if len(batch) == 0:
+            return
+        x, y = batch.positions[-1]
+        velocity = batch.velocity()
+        if velocity is not None:
+            x += velocity[0] * self.lead
+            y += velocity[1] * self.lead
+        with self.cond:
+            self.stats["events"] += 1
+            target = self.angle_for(x, y)
+            if (abs(target[0] - self.angle[0]) < self.deadband) and (abs(target[1] - self.angle[1]) < self.deadband):
+                self.stats["deadband"] += 1
+                return
+            if self.target is not None:
+                self.stats["superseded"] += 1
+            self.target = target
+            self.target_time = now
+            self.cond.notify_all()
+
+    def angle_for(self, x, y):
+        """
+        画像上の座標に顔を向ける頭部角度
+        @return (水平, 上下)(度、整数)
+        """
+        width, height = self.image_size
+        dx = (x / width - 0.5) * self.fov[0] * self.signs[0]
+        dy = (y / height - 0.5) * self.fov[1] * self.signs[1]
+        horizontal = clip(round(self.angle[0] + self.gain * dx), self.limits["horizontal"])
+        vertical = clip(round(self.angle[1] + self.gain * dy), self.limits["vertical"])
+        return horizontal, vertical
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.running:
+                        return
+                    if self.target is None:
+                        self.cond.wait()
+                        continue
+                    now = time.monotonic()
+                    if self.limiter.take(now):
+                        break
+                    self.cond.wait(self.limiter.next_time(now) - now)
+                horizontal, vertical = self.target
+                received = self.target_time
+                self.target = None
+                self.angle = (horizontal, vertical)
+            if self.papero.errOccurred != 0:
+                continue
+            # 次の指示までに動き終わる時間で動かす
+            ms = int(self.interval * 1000)
+            self.papero.send_move_head(["A%dT%dL" % (vertical, ms)], ["A%dT%dL" % (horizontal, ms)])
+            with self.cond:
+                self.stats["sent"] += 1
+                self.reaction = time.monotonic() - received
+
+
+def clip(value, limits):
+    return max(limits[0], min(limits[1], value))
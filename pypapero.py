@@ -27,17 +27,31 @@
 # 2016/05/25(β版)
 #   ・初版公開
 ##############################################################
-from logging import getLogger, debug, info, warn, error, critical
+from logging import getLogger, debug, info, warn, error, critical, DEBUG
 logger = getLogger(__name__)
 
 import threading
 import json
+import re
 import queue
 import time
 import math
+import collections
+import concurrent.futures
+import contextlib
 
 from ws4py.client.threadedclient import WebSocketClient
 
+import papero_metrics
+import papero_inbound
+import papero_events
+import papero_scheduler
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class PaperoClient(WebSocketClient):
     """
@@ -49,6 +63,7 @@ class PaperoClient(WebSocketClient):
         回線接続時の処理
         """
         self.papero.wsAvail = True
+        self.papero.wsOpened.set()
         logger.debug("-------------------")
         logger.debug("connected")
         logger.debug("--------------------")
@@ -58,8 +73,7 @@ class PaperoClient(WebSocketClient):
         回線切断時の処理
         """
         if self.papero is not None:
-            self.papero.wsAvail = False
-            self.papero.queFromCom.put(None)
+            self.papero.papero_on_closed(self)
             self.papero = None
         logger.debug("-------------------")
         logger.debug("disconnected")
@@ -69,23 +83,112 @@ class PaperoClient(WebSocketClient):
         """
         伝文受信時の処理
         """
-        message = str(msgrcv)
-        logger.debug("received:" + message)
-        self.papero.queFromCom.put(message)
+        if isinstance(msgrcv.data, (bytes, bytearray)):
+            message = InboundMessage(msgrcv.data, msgrcv.encoding or "utf-8")
+            message.raw = msgrcv.data
+        else:
+            message = InboundMessage(str(msgrcv))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("received:" + message)
+        self.papero.papero_dispatch(message)
+
+
+def json_dumps_std(obj):
+    return json.dumps(obj)
+
+
+def json_dumps_orjson(obj):
+    return orjson.dumps(obj).decode("utf-8")
+
+
+json_dumps = json_dumps_std
+json_loads = json.loads
+
+
+def set_json_backend(name):
+    """
+    伝文のJSON変換に使うライブラリの切り替え
+    @param name:"json"(標準ライブラリ)又は"orjson"
+    """
+    global json_dumps, json_loads
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        json_dumps = json_dumps_orjson
+        json_loads = orjson.loads
+    elif name == "json":
+        json_dumps = json_dumps_std
+        json_loads = json.loads
+    else:
+        raise ValueError("unknown json backend: " + str(name))
+
+
+if orjson is not None:
+    set_json_backend("orjson")
+
+
+class InboundMessage(str):
+    """
+    受信伝文(JSON文字列)
+    デコード結果をキャッシュし、1伝文につき高々1回しかデコードしない
+    """
+    raw = None  # 受信したバイト列(あればこちらをデコードする)
+    decoded = None
+
+    def json(self):
+        """
+        @return デコードした辞書(共有されるので変更しないこと)
+        """
+        if self.decoded is None:
+            # orjsonはstrのサブクラスを受け付けない
+            self.decoded = json_loads(self.raw if self.raw is not None else str(self))
+        return self.decoded
+
+
+def decode_message(message):
+    """
+    受信伝文のデコード(InboundMessageならキャッシュを使う)
+    @param message:受信伝文
+    @return 辞書
+    """
+    if isinstance(message, InboundMessage):
+        return message.json()
+    return json_loads(message)
+
+
+NAME_PATTERN = re.compile(r'"Name"\s*:\s*"([^"\\]*)"')
+
+
+def scan_message_names(message):
+    """
+    デコードせずに伝文名を取り出す(振り分け判定用)
+    @param message:受信伝文
+    @return (伝文名, RobotMessage中の伝文名のリスト)
+    """
+    names = NAME_PATTERN.findall(message)
+    if "RobotMessage" in names:
+        names.remove("RobotMessage")
+        return "RobotMessage", names
+    return (names[0] if len(names) > 0 else None), []
+
+
+_now_time_cache = (None, "")  # (秒, 時刻文字列)
+# set_common_for_commandが設定する送信時刻の形式
+ROBOT_TIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
 
 
 def get_now_time_for_robot_message():
     """
-    ロボット伝文送信の為の時刻取得
+    ロボット伝文送信の為の時刻取得(同じ秒の間は前回の文字列を返す)
     """
-    t = time.localtime()
-    str_yyyy = str(t.tm_year)
-    str_mth = ("0" + str(t.tm_mon))[-2:]
-    str_day = ("0" + str(t.tm_mday))[-2:]
-    str_hh = ("0" + str(t.tm_hour))[-2:]
-    str_mm = ("0" + str(t.tm_min))[-2:]
-    str_ss = ("0" + str(t.tm_sec))[-2:]
-    return str_yyyy + "-" + str_mth + "-" + str_day + " " + str_hh + ":" + str_mm + ":" + str_ss
+    global _now_time_cache
+    sec = int(time.time())
+    cached_sec, cached_str = _now_time_cache
+    if sec == cached_sec:
+        return cached_str
+    str_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+    _now_time_cache = (sec, str_time)
+    return str_time
 
 
 def set_common_for_command(msg_dic_snd, msg_name, msg_dst):
@@ -103,13 +206,103 @@ def build_seq_str(list_seq, n_limit):
     """
     Motor・LED関連コマンド用シーケンス文字列組み立て
     """
-    n = min(len(list_seq), n_limit)
-    rtn_str = ""
-    for i in range(n):
-        if rtn_str != "":
-            rtn_str += ","
-        rtn_str += list_seq[i]
-    return rtn_str
+    return ",".join(list_seq[:n_limit])
+
+
+class EncodedMessage(dict):
+    """
+    JSON文字列(encoded)を保持したコマンド辞書
+    (送信時に再エンコードしない)
+    """
+    __slots__ = ("encoded",)
+
+
+class CommandTemplate:
+    """
+    コンパイル済みコマンド
+    MessageID・Time以外の項目を事前にJSON化しておき、送信時はその2項目のみ埋め込む
+    (Timeをコマンド固有の引数に使うコマンド(setAccSensorThreshold)はTimeも事前にJSON化する)
+    """
+
+    def __init__(self, message):
+        """
+        @param message:send_*で組み立てたコマンド辞書
+        """
+        self.fields = dict(message)
+        self.fields.pop("MessageID", None)
+        # 送信時刻の場合のみ送信時に埋め込む
+        self.stamp_time = ROBOT_TIME_PATTERN.match(str(self.fields.get("Time", ""))) is not None
+        if self.stamp_time:
+            del self.fields["Time"]
+        self.name = self.fields["Name"]
+        # '{"Name": ...}' の先頭の '{' を除いた残り
+        self.encoded_rest = json_dumps(self.fields)[1:]
+
+    def render(self, message_id, time_str):
+        """
+        @param message_id:MessageID
+        @param time_str:Time
+        @return EncodedMessage
+        """
+        message = EncodedMessage(self.fields)
+        message["MessageID"] = message_id
+        if not self.stamp_time:
+            message.encoded = '{"MessageID": "' + message_id + '", ' + self.encoded_rest
+            return message
+        message["Time"] = time_str
+        message.encoded = '{"MessageID": "' + message_id + '", "Time": "' + time_str + '", ' + self.encoded_rest
+        return message
+
+
+class CommandRecorder:
+    """
+    send_*を送信せずに実行し、組み立てたコマンドを記録する
+    """
+
+    def __init__(self):
+        self.messageID = 0
+        self.messages = []
+
+    def papero_new_message_id(self):
+        message_id = str(self.messageID)
+        self.messageID += 1
+        return message_id
+
+    def send_robot_message(self, message):
+        self.messages.append(message)
+
+
+def compile_command(send_func, *args, **kwargs):
+    """
+    コマンドを事前コンパイル
+        compile_command(Papero.send_start_speech, "こんにちは")
+    @param send_func:Papero.send_*関数
+    @return CommandTemplate
+    """
+    recorder = CommandRecorder()
+    send_func(recorder, *args, **kwargs)
+    return CommandTemplate(recorder.messages[0])
+
+
+def encode_robot_message(message):
+    """
+    コマンド辞書をJSON文字列に変換(エンコード済みならそのまま)
+    """
+    if isinstance(message, EncodedMessage):
+        return message.encoded
+    return json_dumps(message)
+
+
+RESPONSE_HISTORY_SIZE = 256  # 受信済み応答の保持数
+PENDING_RESPONSE_LIMIT = 4096  # 応答待ちFutureの上限
+BATCH_MAX_MESSAGES = 32  # 1伝文にまとめるコマンド数の上限
+SPEECH_DONE_TIMEOUT = 30.0  # 終了処理で発話の完了を待つ時間の上限(秒)
+WRITER_FLUSH_TIMEOUT = 5.0  # 切断前に送信スレッドの書き込み完了を待つ時間の上限(秒)
+RECONNECT_ATTEMPTS = 8  # 回線切断時の再接続試行回数(0で再接続しない)
+RECONNECT_BACKOFF_MIN = 0.5  # 再接続間隔の初期値(秒、試行ごとに倍)
+RECONNECT_BACKOFF_MAX = 8.0  # 再接続間隔の上限(秒)
+RECONNECT_TIMEOUT = 10.0  # 接続・Ready受信の待ち時間(秒)
+RECONNECT_BUFFER_SIZE = 256  # 再接続中に保留するコマンド数の上限
 
 
 class Papero:
@@ -117,8 +310,20 @@ class Papero:
     Paperoクラス
     """
 
-    def __init__(self, simulator_id, robot_name, arg_ws_server_addr):
+    def __init__(self, simulator_id, robot_name, arg_ws_server_addr, init_timeout=None):
+        """
+        @param simulator_id:シミュレータID
+        @param robot_name:ロボット名
+        @param arg_ws_server_addr:WebSocket接続先(""ならデフォルトの接続先)
+        @param init_timeout:Ready受信までの待ち時間(秒、Noneなら無制限)
+        """
+        self.papero_setup(simulator_id, robot_name, arg_ws_server_addr)
+        self.papero_connect()
+        self.papero_init(init_timeout)
+
+    def papero_setup(self, simulator_id, robot_name, arg_ws_server_addr):
         """
+        接続前の状態初期化
         @param simulator_id:シミュレータID
         @param robot_name:ロボット名
         @param arg_ws_server_addr:WebSocket接続先(""ならデフォルトの接続先)
@@ -129,79 +334,194 @@ class Papero:
         logger.debug("simulator_id=" + str(simulator_id))
         logger.debug("robot_name=" + str(robot_name))
         logger.debug("ws_server_addr=" + str(ws_server_addr))
+        self.wsServerAddr = ws_server_addr
         self.simulatorID = simulator_id
         self.robotName = robot_name
         self.robotID = 0
-        self.messageID = 0
+        self.messageID = 0  # 次に割り当てるMessageID
+        self.message_id_lock = threading.Lock()
         self.errOccurred = 0
         self.errDetail = ""
         self.scriptMayFinish = False
+        self.sessionReady = False
+        # スレッド間通信用キュー(上限・伝文名ごとの保持ポリシー付き)
+        self.queFromCom = papero_inbound.PaperoInboundQueue()
+        # 発話完了待ち(startSpeechのMessageIDの集合、startSpeechRes受信で削除)
+        self.speech_lock = threading.Condition()
+        self.speech_pending = set()
+        # 応答待ち管理(MessageID→Future)
+        self.response_lock = threading.Lock()
+        self.pending_responses = collections.OrderedDict()
+        self.completed_responses = collections.OrderedDict()
+        # 通信メトリクス
+        self.metrics = papero_metrics.PaperoMetrics()
+        # イベント購読
+        self.events = papero_events.EventDispatcher()
+        # 送信コマンドの購読
+        self.sent_events = papero_events.EventDispatcher()
+        # コマンドのまとめ送り
+        self.batch_local = threading.local()
+        self.batch_lock = threading.Lock()
+        self.batch_window = 0.0
+        self.batch_pending = []
+        self.batch_timer = None
         # WebSocket関連
         self.wsAvail = False
-        # self.ws = PaperoClient(ws_server_addr, protocols=['http-only'])
-        self.ws = PaperoClient(ws_server_addr, protocols=None)
+        self.wsOpened = threading.Event()
+        self.ws = None
+        # 送信スレッド(WebSocketへの書き込みはこのスレッドのみで行う)
+        self.outbox = queue.SimpleQueue()
+        self.writer = None
+        # 再接続
+        self.reconnect_attempts = RECONNECT_ATTEMPTS
+        self.reconnect_lock = threading.RLock()
+        self.reconnecting = False
+        self.reconnect_ready = threading.Event()
+        self.reconnect_robot_id = None
+        self.reconnect_count = 0
+        self.outage_buffer = collections.deque()
+        self.outage_dropped = 0
+        # 送信スケジューラ(papero_start_scheduler()で有効)
+        self.scheduler = None
+        self.scheduler_lock = threading.Condition()
+
+    def papero_connect(self):
+        """
+        WebSocket接続
+        """
+        # self.ws = PaperoClient(self.wsServerAddr, protocols=['http-only'])
+        if self.ws is not None:
+            # 置き換えられた古い接続の切断は通知しない
+            self.ws.papero = None
+        self.ws = PaperoClient(self.wsServerAddr, protocols=None)
         self.ws.papero = self
         self.ws.connect()
-        # スレッド間通信用キュー
-        self.queFromCom = queue.Queue()
-        # Ver.1.01 発話コマンド個数管理
-        self.remain_speech_count = 0
-        self.papero_init()
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.papero_writer_loop)
+            self.writer.daemon = True
+            self.writer.start()
 
-    def papero_init(self):
+    def papero_init(self, timeout=None):
         """
         パペロ初期化
+        @param timeout:Ready受信までの待ち時間(秒、Noneなら無制限)
         """
-        while not self.wsAvail:
-            time.sleep(0.1)
-        self.send_select_sim_robot()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.wsOpened.wait(timeout)
+        if self.wsAvail:
+            self.send_select_sim_robot()
         while True:
-            message = self.papero_recv(None)
-            if message is not None:
-                msg_dic_rcv = json.loads(message)
-                if msg_dic_rcv["Name"] == "Ready":
-                    self.robotID = msg_dic_rcv["RobotID"]
-                    break
-                elif msg_dic_rcv["Name"] == "Error":
-                    logger.error("------Received error (papero_init()). Detail : " + msg_dic_rcv["Detail"])
-                    self.papero_send(None)
-                    self.errOccurred = 1
-                    self.errDetail = "Inithalize failed"
-                    break
-            elif self.errOccurred != 0:
+            remain = None if deadline is None else deadline - time.monotonic()
+            if (remain is not None) and (remain <= 0):
+                self.errOccurred = 2
+                self.errDetail = "Initialize timed out"
                 logger.error("------Error occurred(papero_init()). Detail : " + self.errDetail)
                 self.papero_send(None)
+                return
+            if self.papero_init_step(self.papero_recv(remain)):
+                return
+
+    def papero_init_step(self, message):
+        """
+        初期化中の受信伝文処理
+        @param message:受信伝文
+        @return 初期化処理が終了した場合True
+        """
+        if message is not None:
+            msg_dic_rcv = decode_message(message)
+            if msg_dic_rcv["Name"] == "Ready":
+                self.robotID = msg_dic_rcv["RobotID"]
+                self.sessionReady = True
+                return True
+            elif msg_dic_rcv["Name"] == "Error":
+                logger.error("------Received error (papero_init()). Detail : " + msg_dic_rcv["Detail"])
+                self.papero_send(None)
+                self.errOccurred = 1
                 self.errDetail = "Inithalize failed"
-                break
+                return True
+        elif self.errOccurred != 0:
+            logger.error("------Error occurred(papero_init()). Detail : " + self.errDetail)
+            self.papero_send(None)
+            self.errDetail = "Inithalize failed"
+            return True
+        return False
 
     def papero_send(self, msg_dic_snd):
         """
         伝文送信
-        @param msg_dic_snd:送信するJSON文字列(Noneを設定すると通信終了となる)
+        @param msg_dic_snd:送信する辞書又はJSON文字列(Noneを設定すると通信終了となる)
         """
+        if msg_dic_snd is None:
+            self.papero_flush_batch()
+            self.papero_stop_scheduler()
+            self.scriptMayFinish = True
+            self.papero_drop_outage_buffer()
         if self.ws is not None:
             if msg_dic_snd is None:
-                self.scriptMayFinish = True
+                self.papero_flush_writer(WRITER_FLUSH_TIMEOUT)
+                # 切断すると発話中の応答も失敗扱いになるので、発話の完了を待ってから切断する
+                self.all_speech_done(SPEECH_DONE_TIMEOUT)
                 self.ws.close()
-                past_time = 0.0
-                delta_time = 0.1
-                st = 0
-                while self.wsAvail and (self.errOccurred == 0) and (st >= 0):
-                    messages = self.papero_robot_message_recv(delta_time)
-                    if st == 0:
-                        if (self.remain_speech_count <= 0) or (past_time > 5.0):
-                            st = 1
-                        else:
-                            past_time += delta_time
-                    elif st == 1:
-                        if messages is None:
-                            st = (-1)
+                while self.wsAvail and (self.errOccurred == 0):
+                    if self.papero_robot_message_recv(0.1) is None:
+                        break
                 self.wsAvail = False
                 self.ws = None
+                if self.writer is not None:
+                    self.outbox.put(None)
+                    self.writer = None
             else:
-                msg_json_snd = json.dumps(msg_dic_snd)
-                self.ws.send(msg_json_snd)
-                logger.debug("sending:" + msg_json_snd)
+                if self.reconnecting and not self.wsAvail:
+                    logger.warning("------Frame dropped during reconnect (papero_send())")
+                    return
+                if isinstance(msg_dic_snd, str):
+                    msg_json_snd = msg_dic_snd
+                else:
+                    msg_json_snd = json_dumps(msg_dic_snd)
+                self.outbox.put((self.ws, msg_json_snd))
+                if logger.isEnabledFor(DEBUG):
+                    logger.debug("sending:" + msg_json_snd)
+
+    def papero_writer_loop(self):
+        """
+        送信スレッド(papero_sendから渡された伝文を順にWebSocketに書き込む)
+        """
+        while True:
+            item = self.outbox.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            ws, msg_json_snd = item
+            try:
+                ws.send(msg_json_snd)
+            except Exception as e:
+                logger.error("------Error occurred(papero_writer_loop()). Detail : " + str(e))
+                continue
+            self.metrics.frame_sent(msg_json_snd)
+
+    def papero_flush_writer(self, t):
+        """
+        送信スレッドに渡した伝文の書き込み完了待ち
+        @param t:タイムアウト
+        @return 完了した場合True
+        """
+        if self.writer is None:
+            return True
+        done = threading.Event()
+        self.outbox.put(done)
+        return done.wait(t)
+
+    def papero_new_message_id(self):
+        """
+        MessageIDの割り当て(スレッドセーフ)
+        @return messageID(文字列)
+        """
+        with self.message_id_lock:
+            message_id = self.messageID
+            self.messageID += 1
+        return str(message_id)
 
     def send_select_sim_robot(self):
         """
@@ -217,11 +537,190 @@ class Papero:
         """
         ロボット伝文送信
         """
-        msg_dic_snd = {}
-        msg_dic_snd["Name"] = "RobotMessage"
-        msg_dic_snd["RobotID"] = self.robotID
-        msg_dic_snd["Messages"] = [message]
-        self.papero_send(msg_dic_snd)
+        self.sent_events.dispatch(message)
+        if "MessageID" in message:
+            future = self.papero_response_future(message["MessageID"])
+            if message.get("Name") == "startSpeech":
+                self.papero_track_speech(message["MessageID"])
+        batch = getattr(self.batch_local, "messages", None)
+        if batch is not None:
+            batch.append(message)
+        elif self.batch_window > 0.0:
+            messages = None
+            with self.batch_lock:
+                self.batch_pending.append(message)
+                if len(self.batch_pending) >= BATCH_MAX_MESSAGES:
+                    messages = self.batch_pending
+                    self.batch_pending = []
+                elif self.batch_timer is None:
+                    self.batch_timer = self.papero_start_batch_timer(self.batch_window)
+            if messages is not None:
+                self.send_robot_messages(messages)
+        else:
+            self.send_robot_messages([message])
+
+    def send_robot_messages(self, messages):
+        """
+        複数コマンドを1つのロボット伝文で送信(スケジューラ有効時は送信待ちキューに入れる)
+        @param messages:コマンドのリスト
+        """
+        if self.scheduler is not None:
+            self.papero_schedule_messages(messages)
+        else:
+            self.papero_transmit_messages(messages)
+
+    def papero_transmit_messages(self, messages):
+        """
+        複数コマンドを1つのロボット伝文で送信(再接続中は保留)
+        @param messages:コマンドのリスト
+        """
+        with self.reconnect_lock:
+            if self.reconnecting:
+                self.papero_buffer_messages(messages)
+                return
+            head = '{"Name": "RobotMessage", "RobotID": ' + json_dumps(self.robotID) + ', "Messages": ['
+            for i in range(0, len(messages), BATCH_MAX_MESSAGES):
+                chunk = messages[i:i + BATCH_MAX_MESSAGES]
+                encoded = [encode_robot_message(m) for m in chunk]
+                for m in chunk:
+                    self.metrics.command_sent(m)
+                self.papero_send(head + ", ".join(encoded) + "]}")
+
+    def papero_start_scheduler(self, rates=None):
+        """
+        送信スケジューラ開始
+        ・Priorityが"higher"のコマンドを"normal"より先に送信
+        ・送信先(Destination)ごとに送信頻度を制限
+        ・送信待ちのmoveHead、turnLedOn/turnLedOff(同じ部位)は新しいコマンドで置き換える
+          (置き換えられたコマンドの応答待ちはpapero_scheduler.CommandSupersededで終了する)
+        @param rates:送信先→(1秒あたりのコマンド数, バースト数)(Noneならpapero_scheduler.DESTINATION_RATES)
+        """
+        with self.scheduler_lock:
+            if self.scheduler is not None:
+                return
+            self.scheduler = papero_scheduler.OutboundScheduler(rates)
+            scheduler = self.scheduler
+        th = threading.Thread(target=self.papero_scheduler_loop, args=(scheduler,))
+        th.daemon = True
+        th.start()
+
+    def papero_stop_scheduler(self):
+        """
+        送信スケジューラ停止(送信待ちのコマンドは流量制限を無視して送信する)
+        """
+        with self.scheduler_lock:
+            scheduler = self.scheduler
+            if scheduler is None:
+                return
+            self.scheduler = None
+            self.papero_wake_scheduler()
+            messages = scheduler.pop_all()
+            if len(messages) > 0:
+                self.papero_transmit_messages(messages)
+
+    def papero_schedule_messages(self, messages):
+        """
+        コマンドを送信待ちキューに入れる
+        @param messages:コマンドのリスト
+        """
+        superseded = []
+        with self.scheduler_lock:
+            scheduler = self.scheduler
+            if scheduler is None:
+                self.papero_transmit_messages(messages)
+                return
+            for message in messages:
+                old = scheduler.push(message)
+                if old is not None:
+                    superseded.append((old.get("MessageID"), message.get("MessageID")))
+            self.papero_wake_scheduler()
+        for message_id, superseded_by in superseded:
+            self.papero_fail_response(message_id, papero_scheduler.CommandSuperseded(message_id, superseded_by))
+
+    def papero_wake_scheduler(self):
+        """
+        送信スレッドを起こす(scheduler_lockを取得した状態で呼ぶ)
+        """
+        self.scheduler_lock.notify()
+
+    def papero_scheduler_loop(self, scheduler):
+        """
+        送信スレッド(送信はscheduler_lock内で行い、papero_stop_scheduler()との順序を保つ)
+        @param scheduler:OutboundScheduler
+        """
+        with self.scheduler_lock:
+            while self.scheduler is scheduler:
+                now = time.monotonic()
+                messages = scheduler.pop_ready(now, BATCH_MAX_MESSAGES)
+                if len(messages) > 0:
+                    self.papero_transmit_messages(messages)
+                    continue
+                wake = scheduler.next_ready_time(now)
+                self.scheduler_lock.wait(None if wake is None else wake - now)
+
+    def send_command_template(self, template):
+        """
+        コンパイル済みコマンド送信
+        @param template:CommandTemplate
+        @return messageID
+        """
+        message_id = self.papero_new_message_id()
+        self.send_robot_message(template.render(message_id, get_now_time_for_robot_message()))
+        return message_id
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        withブロック内で送信したコマンドを1つのロボット伝文にまとめて送信する
+        (スレッド単位。入れ子の場合は最も外側でまとめて送信)
+            with papero.batch():
+                papero.send_move_head(...)
+                papero.send_start_speech(...)
+        """
+        if getattr(self.batch_local, "messages", None) is not None:
+            yield
+            return
+        self.batch_local.messages = []
+        try:
+            yield
+        finally:
+            messages = self.batch_local.messages
+            self.batch_local.messages = None
+            if len(messages) > 0:
+                self.send_robot_messages(messages)
+
+    def papero_set_batch_window(self, t):
+        """
+        まとめ送りの待ち時間設定
+        @param t:最初のコマンドからt秒以内に送信されたコマンドをまとめる(0.0で無効)
+        """
+        self.batch_window = t
+        if t <= 0.0:
+            self.papero_flush_batch()
+
+    def papero_start_batch_timer(self, t):
+        """
+        まとめ送り用タイマー開始
+        @param t:待ち時間
+        @return タイマー
+        """
+        timer = threading.Timer(t, self.papero_flush_batch)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def papero_flush_batch(self):
+        """
+        まとめ送り待ちのコマンドを送信
+        """
+        with self.batch_lock:
+            messages = self.batch_pending
+            self.batch_pending = []
+            if self.batch_timer is not None:
+                self.batch_timer.cancel()
+                self.batch_timer = None
+        if len(messages) > 0:
+            self.send_robot_messages(messages)
 
     def send_script_end(self):
         """
@@ -258,14 +757,13 @@ class Papero:
         set_common_for_command(msg_dic_snd, "moveHead", "MotorController")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["VerticalSequence"] = str(min(len(vertical), 64))
         msg_dic_snd["HorizontalSequence"] = str(min(len(horizontal), 64))
         msg_dic_snd["Repeat"] = str_repeat
         msg_dic_snd["Vertical"] = build_seq_str(vertical, 64)
         msg_dic_snd["Horizontal"] = build_seq_str(horizontal, 64)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_head(self, priority="normal"):
@@ -278,9 +776,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "stopHead", "MotorController")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_reset_head(self, priority="normal"):
@@ -293,9 +790,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "resetHead", "MotorController")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_head_status(self, priority="normal"):
@@ -308,9 +804,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getHeadStatus", "MotorController")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_turn_led_on(self, part, pattern, repeat=False, priority="normal"):
@@ -329,13 +824,12 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "turnLedOn", "LEDController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Part"] = part
         msg_dic_snd["Sequence"] = str(min(math.floor(len(pattern) / 2), 26))
         msg_dic_snd["Repeat"] = str_repeat
         msg_dic_snd["Pattern"] = build_seq_str(pattern, 26 * 2)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_turn_led_off(self, part, priority="normal"):
@@ -348,10 +842,9 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "turnLedOff", "LEDController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Part"] = part
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_default_status_led(self, status, priority="normal"):
@@ -364,11 +857,10 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "setDefaultStatus", "LEDController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Target"] = "Luminance"
         msg_dic_snd["Status"] = status
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_default_status_led(self, priority="normal"):
@@ -380,10 +872,9 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getDefaultStatus", "LEDController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Target"] = "Luminance"
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_led_status(self, part, priority="normal"):
@@ -396,10 +887,9 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getLedStatus", "LEDController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Part"] = part
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_speech(self, text,
@@ -424,7 +914,7 @@ class Papero:
         set_common_for_command(msg_dic_snd, "startSpeech", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Text"] = text
         if language is not None:
             msg_dic_snd["Language"] = str(language)
@@ -443,8 +933,6 @@ class Papero:
         if urgent is not None:
             msg_dic_snd["Urgent"] = str(urgent)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
-        self.remain_speech_count += 1 # Ver.1.01 発話コマンド個数管理
         return msg_dic_snd["MessageID"]
 
     def send_pause_speech(self, priority="normal"):
@@ -457,9 +945,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "pauseSpeech", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_resume_speech(self, priority="normal"):
@@ -472,9 +959,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "resumeSpeech", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_speech(self, priority="normal"):
@@ -487,9 +973,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "stopSpeech", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_speech_status(self, priority="normal"):
@@ -502,9 +987,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getSpeechStatus", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_default_status_speech(self, language="0", speaker_id="3",
@@ -527,7 +1011,7 @@ class Papero:
         set_common_for_command(msg_dic_snd, "setDefaultStatus", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Language"] = str(language)
         msg_dic_snd["SpeakerID"] = str(speaker_id)
         msg_dic_snd["Pitch"] = str(pitch)
@@ -536,7 +1020,6 @@ class Papero:
         msg_dic_snd["Pause"] = str(pause)
         msg_dic_snd["CommaPause"] = str(comma_pause)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_default_status_speech(self, priority="normal"):
@@ -549,9 +1032,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getDefaultStatus", "SpeechSynthesizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_sensor_value(self, priority="normal"):
@@ -563,9 +1045,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getSensorValue", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_acc_sensor(self, priority="normal"):
@@ -577,9 +1058,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "startAccSensor", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_acc_sensor(self, priority="normal"):
@@ -591,9 +1071,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopAccSensor", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_acc_sensor(self, mem_size, full_scale, data_rate, priority="normal"):
@@ -608,12 +1087,11 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "setAccSensor", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["MemSize"] = str(mem_size)
         msg_dic_snd["FullScale"] = str(full_scale)
         msg_dic_snd["DataRate"] = str(data_rate)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_acc_sensor_state(self, priority="normal"):
@@ -625,9 +1103,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getAccSensorState", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_acc_sensor_threshold(self, det_value, los_value, frequency, arg_time, priority="normal"):
@@ -643,13 +1120,12 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "setAccSensorThreshold", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["DetValue"] = str(det_value)
         msg_dic_snd["LosValue"] = str(los_value)
         msg_dic_snd["Frequency"] = str(frequency)
         msg_dic_snd["Time"] = str(arg_time)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_lum_sensor(self, priority="normal"):
@@ -661,9 +1137,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "startLumSensor", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_lum_sensor(self, priority="normal"):
@@ -675,9 +1150,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopLumSensor", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_lum_sensor_value(self, priority="normal"):
@@ -689,9 +1163,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getLumSensorValue", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_lum_sensor_state(self, priority="normal"):
@@ -703,9 +1176,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getLumSensorState", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_cancel_command(self, target_id, priority="normal"):
@@ -718,10 +1190,9 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getSensorValue", "SensorController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["TargetID"] = target_id
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_speech_recognition(self, priority="normal"):
@@ -734,9 +1205,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "startSpeechRecognition", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_speech_recognition(self, priority="normal"):
@@ -749,9 +1219,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "stopSpeechRecognition", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_speech_recognition_status(self, priority="normal"):
@@ -764,9 +1233,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getSpeechRecognitionStatus", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_read_dictionary(self, mrg_file_name, priority="normal"):
@@ -780,10 +1248,9 @@ class Papero:
         set_common_for_command(msg_dic_snd, "readDictionary", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["MrgFileName"] = mrg_file_name
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_free_dictionary(self, mrg_file_name, priority="normal"):
@@ -797,10 +1264,9 @@ class Papero:
         set_common_for_command(msg_dic_snd, "freeDictionary", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["MrgFileName"] = mrg_file_name
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_add_speech_recognition_rule(self, rule_name, priority="normal"):
@@ -814,10 +1280,9 @@ class Papero:
         set_common_for_command(msg_dic_snd, "addSpeechRecognitionRule", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["RuleName"] = rule_name
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_delete_speech_recognition_rule(self, rule_name, priority="normal"):
@@ -831,10 +1296,9 @@ class Papero:
         set_common_for_command(msg_dic_snd, "deleteSpeechRecognitionRule", "SpeechRecognizer")
         msg_dic_snd["Expiration"] = "120"
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["RuleName"] = rule_name
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_take_picture(self, format, filename=None, camera=None, priority="normal"):
@@ -849,14 +1313,13 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "takePicture", "VideoCapture")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Format"] = str(format)
         if filename is not None:
             msg_dic_snd["Filename"] = str(filename)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_delete_capture_data(self, filename, priority="normal"):
@@ -868,10 +1331,9 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "deleteCaptureData", "VideoCapture")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         msg_dic_snd["Filename"] = str(filename)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_capturing(self, share_mem_id, share_mem_size, camera, priority="normal"):
@@ -886,14 +1348,13 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "startCapturing", "CameraController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if share_mem_id is not None:
             msg_dic_snd["ShareMemID"] = str(share_mem_id)
         msg_dic_snd["ShareMemSize"] = str(share_mem_size)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_capturing(self, share_mem_id, camera, priority="normal"):
@@ -907,13 +1368,12 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopCapturing", "CameraController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if share_mem_id is not None:
             msg_dic_snd["ShareMemID"] = str(share_mem_id)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_capture_data(self, share_mem_id, camera, priority="normal"):
@@ -927,13 +1387,12 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getCaptureData", "CameraController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if share_mem_id is not None:
             msg_dic_snd["ShareMemID"] = str(share_mem_id)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_camera_status(self, brightness=None, contrast=None,
@@ -959,7 +1418,7 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "setCameraStatus", "VideoCapture")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if brightness is not None:
             msg_dic_snd["Brightness"] = str(brightness)
         if contrast is not None:
@@ -981,7 +1440,6 @@ class Papero:
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_camera_status(self, object, camera, priority="normal"):
@@ -995,13 +1453,12 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getCameraStatus", "VideoCapture")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if object is not None:
             msg_dic_snd["Object"] = str(object)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_one_shot_capture_data(self, share_mem_id, share_mem_size,
@@ -1017,14 +1474,13 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getOneShotCaptureData", "CameraController")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         if share_mem_id is not None:
             msg_dic_snd["ShareMemID"] = str(share_mem_id)
         msg_dic_snd["ShareMemSize"] = str(share_mem_size)
         if camera is not None:
             msg_dic_snd["Camera"] = str(camera)
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_face_detection(self, min_eye_distance, priority="normal"):
@@ -1039,9 +1495,8 @@ class Papero:
         msg_dic_snd["Priority"] = priority
         if min_eye_distance is not None:
             msg_dic_snd["MinEyeDistance"] = str(min_eye_distance)
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_face_detection(self, priority="normal"):
@@ -1053,9 +1508,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopFaceDetection", "FaceDetection")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_recording(self, filename=None, bitlength=None, bitrate=None,
@@ -1085,9 +1539,8 @@ class Papero:
         if recordingtime is not None:
             msg_dic_snd["RecordingTime"] = str(recordingtime)
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_recording(self, priority="normal"):
@@ -1099,9 +1552,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopRecording", "WaveRecorder")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_delete_recording_data(self, filename, priority="normal"):
@@ -1115,9 +1567,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "deleteRecordingData", "WaveRecorder")
         msg_dic_snd["Filename"] = filename
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_recording_status(self, priority="normal"):
@@ -1129,9 +1580,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getRecordingStatus", "WaveRecorder")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_default_status_wavrec(self, bitrate=None, channel=None,
@@ -1157,9 +1607,8 @@ class Papero:
         if recordingtime is not None:
             msg_dic_snd["RecordingTime"] = str(recordingtime)
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_default_status_wavrec(self, object, priority="normal"):
@@ -1173,9 +1622,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getDefaultStatus", "WaveRecorder")
         msg_dic_snd["Object"] = object
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_playing(self, filename, volume=None, category=1, priority="normal"):
@@ -1194,9 +1642,8 @@ class Papero:
             msg_dic_snd["Volume"] = str(volume)
         msg_dic_snd["Category"] = str(category)
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_playing(self, priority="normal"):
@@ -1208,9 +1655,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopPlaying", "WavePlayer")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_delete_wave_data(self, filename, priority="normal"):
@@ -1224,9 +1670,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "deleteWaveData", "WavePlayer")
         msg_dic_snd["Filename"] = filename
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_playing_status(self, priority="normal"):
@@ -1238,9 +1683,8 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "getPlayingStatus", "WavePlayer")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_set_default_status_wavplay(self, volume, priority="normal"):
@@ -1254,9 +1698,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "setDefaultStatus", "WavePlayer")
         msg_dic_snd["Volume"] = volume
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_get_default_status_wavplay(self, object, priority="normal"):
@@ -1270,9 +1713,8 @@ class Papero:
         set_common_for_command(msg_dic_snd, "getDefaultStatus", "WavePlayer")
         msg_dic_snd["Object"] = object
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_start_motion(self, motion_id, sound="None", text=None, priority="normal"):
@@ -1296,9 +1738,8 @@ class Papero:
             msg_dic_snd["Argv3"] = text
         msg_dic_snd["Argc"] = str(argc)
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
     def send_stop_motion(self, priority="normal"):
@@ -1310,11 +1751,332 @@ class Papero:
         msg_dic_snd = {}
         set_common_for_command(msg_dic_snd, "stopMotion", "SystemManager")
         msg_dic_snd["Priority"] = priority
-        msg_dic_snd["MessageID"] = str(self.messageID)
+        msg_dic_snd["MessageID"] = self.papero_new_message_id()
         self.send_robot_message(msg_dic_snd)
-        self.messageID += 1
         return msg_dic_snd["MessageID"]
 
+    def papero_on_closed(self, client):
+        """
+        回線切断時の処理(PaperoClient.closedから呼ばれる)
+        初期化済みで終了処理中でなければ再接続を開始する
+        @param client:切断されたPaperoClient(置き換えられた接続はpaperoがNoneなので呼ばれない)
+        """
+        self.wsAvail = False
+        self.wsOpened.set()
+        if self.scriptMayFinish or (not self.sessionReady) or (self.errOccurred != 0) \
+                or (self.reconnect_attempts <= 0):
+            self.papero_dispatch(None)
+            return
+        with self.reconnect_lock:
+            if self.reconnecting:
+                return
+            self.reconnecting = True
+        logger.warning("------Disconnected. Reconnecting to " + self.wsServerAddr)
+        # 送信済みで応答を受け取っていないコマンドの応答は届かない
+        self.papero_fail_responses(ConnectionError("Disconnected"))
+        th = threading.Thread(target=self.papero_reconnect_loop)
+        th.daemon = True
+        th.start()
+
+    def papero_reconnect_loop(self):
+        """
+        指数バックオフで再接続し、SelectSimRobot→Ready後に保留中のコマンドを再送する
+        """
+        delay = RECONNECT_BACKOFF_MIN
+        for attempt in range(self.reconnect_attempts):
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+            if self.scriptMayFinish:
+                break
+            logger.info("reconnecting (" + str(attempt + 1) + "/" + str(self.reconnect_attempts) + ")")
+            self.wsOpened.clear()
+            self.reconnect_ready.clear()
+            self.reconnect_robot_id = None
+            try:
+                self.papero_connect()
+            except Exception as e:
+                logger.warning("------Reconnect failed. Detail : " + str(e))
+                continue
+            if (not self.wsOpened.wait(RECONNECT_TIMEOUT)) or (not self.wsAvail):
+                continue
+            self.send_select_sim_robot()
+            if (not self.reconnect_ready.wait(RECONNECT_TIMEOUT)) or (self.reconnect_robot_id is None):
+                logger.warning("------Reconnect failed. Detail : Ready not received")
+                client = self.ws
+                client.papero = None
+                self.wsAvail = False
+                client.close()
+                continue
+            with self.reconnect_lock:
+                self.robotID = self.reconnect_robot_id
+                self.reconnecting = False
+                self.reconnect_count += 1
+                messages = list(self.outage_buffer)
+                self.outage_buffer.clear()
+                if len(messages) > 0:
+                    self.papero_transmit_messages(messages)
+            logger.info("reconnected (replayed " + str(len(messages)) + " commands)")
+            return
+        with self.reconnect_lock:
+            self.reconnecting = False
+        self.papero_drop_outage_buffer()
+        if not self.scriptMayFinish:
+            self.errOccurred = 2
+            self.errDetail = "Disconnected"
+            logger.error("------Error occurred(papero_reconnect_loop()). Detail : " + self.errDetail)
+        self.papero_dispatch(None)
+
+    def papero_buffer_messages(self, messages):
+        """
+        再接続中のコマンドを保留(上限を超えた分は古いものから破棄)
+        """
+        for message in messages:
+            self.outage_buffer.append(message)
+            if len(self.outage_buffer) > RECONNECT_BUFFER_SIZE:
+                dropped = self.outage_buffer.popleft()
+                self.outage_dropped += 1
+                self.papero_fail_response(dropped.get("MessageID"), ConnectionError("Dropped during reconnect"))
+
+    def papero_drop_outage_buffer(self):
+        """
+        保留中のコマンドを破棄
+        """
+        with self.reconnect_lock:
+            messages = list(self.outage_buffer)
+            self.outage_buffer.clear()
+        for message in messages:
+            self.papero_fail_response(message.get("MessageID"), ConnectionError("Disconnected"))
+
+    def papero_available(self):
+        """
+        @return 送信可能(又は再接続中で送信を保留できる)場合True
+        """
+        return (self.errOccurred == 0) and (self.wsAvail or self.reconnecting)
+
+    def papero_dispatch(self, message):
+        """
+        受信伝文の振り分け(受信スレッドから呼ばれる)
+        応答・制御伝文と購読されている伝文のみここでデコードし、
+        それ以外は受信側が取り出すまでデコードしない
+        @param message:受信伝文(Noneは回線切断)
+        """
+        name = None
+        msg_dic_rcv = None
+        if message is None:
+            # 切断後に応答は届かない(発話完了待ちもここで終わる)
+            self.papero_fail_responses(ConnectionError("Disconnected"))
+        else:
+            if not isinstance(message, InboundMessage):
+                message = InboundMessage(message)
+            self.metrics.frame_received(message if message.raw is None else message.raw)
+            name, names = scan_message_names(message)
+            if (name == "RobotMessage") and not self.papero_needs_decode(names):
+                self.queFromCom.put_message(message, names[0])
+                return
+            msg_dic_rcv = message.json()
+            name = msg_dic_rcv.get("Name")
+            if name == "RobotMessage":
+                messages = msg_dic_rcv.get("Messages", [])
+                for msg in messages:
+                    self.papero_resolve_response(msg)
+                if len(messages) > 0:
+                    name = messages[0].get("Name", name)
+            elif self.reconnecting and (name in ("Ready", "Error")):
+                if name == "Ready":
+                    self.reconnect_robot_id = msg_dic_rcv.get("RobotID")
+                self.reconnect_ready.set()
+                return
+        self.queFromCom.put_message(message, name)
+        if msg_dic_rcv is not None:
+            if msg_dic_rcv.get("Name") == "RobotMessage":
+                for msg in msg_dic_rcv.get("Messages", []):
+                    self.events.dispatch(msg)
+            else:
+                self.events.dispatch(msg_dic_rcv)
+
+    def papero_needs_decode(self, names):
+        """
+        RobotMessageを受信スレッドでデコードする必要があるか
+        @param names:RobotMessage中の伝文名のリスト
+        @return 応答伝文又は購読されている伝文を含む場合(名前が取れない場合も)True
+        """
+        if len(names) == 0:
+            return True
+        for name in names:
+            if name.endswith("Res") or self.events.has_subscribers(name):
+                return True
+        return False
+
+    def on(self, pattern, callback, predicate=None, executor=None):
+        """
+        受信伝文の購読
+        例 papero.on("detectFace", cb, predicate=lambda m: m.get("Destination") == "front")
+        コールバックは受信スレッドから伝文1件ごとに呼ばれるので、重い処理はexecutorを指定すること
+        @param pattern:伝文名又はワイルドカード("*"、"detect*"など)
+        @param callback:callback(msg) msgは伝文の辞書
+        @param predicate:predicate(msg)がTrueの伝文のみ配信
+        @param executor:concurrent.futures.Executor等(指定時はsubmitで呼ぶ)
+        @return 購読ハンドル(off()に渡す)
+        """
+        return self.events.subscribe(pattern, callback, predicate, executor)
+
+    def on_sent(self, pattern, callback, predicate=None, executor=None):
+        """
+        送信コマンドの購読(send_*を呼んだスレッドから、まとめ送り・スケジューラに入る前に呼ばれる)
+        @param pattern:コマンド名又はワイルドカード
+        @param callback:callback(msg) msgはコマンドの辞書
+        @return 購読ハンドル(off()に渡す)
+        """
+        return self.sent_events.subscribe(pattern, callback, predicate, executor)
+
+    def off(self, subscription):
+        """
+        購読解除
+        @param subscription:on()又はon_sent()が返したハンドル
+        """
+        self.events.unsubscribe(subscription)
+        self.sent_events.unsubscribe(subscription)
+
+    def papero_response_future(self, message_id):
+        """
+        応答(*Res)待ちFuture取得
+        @param message_id:send_*が返したmessageID
+        @return concurrent.futures.Future(結果は応答伝文の辞書)
+        """
+        message_id = str(message_id)
+        oldest_id = None
+        with self.response_lock:
+            future = self.completed_responses.get(message_id)
+            if future is None:
+                future = self.pending_responses.get(message_id)
+            if future is None:
+                future = concurrent.futures.Future()
+                self.pending_responses[message_id] = future
+                if len(self.pending_responses) > PENDING_RESPONSE_LIMIT:
+                    oldest_id, oldest = self.pending_responses.popitem(last=False)
+                    oldest.cancel()
+        if oldest_id in self.speech_pending:
+            # 応答を受け取れないので発話は完了扱い
+            self.papero_speech_finished(oldest_id)
+        return future
+
+    def papero_resolve_response(self, msg):
+        """
+        応答伝文を対応するFutureに渡す
+        @param msg:RobotMessage中の伝文(辞書)
+        """
+        name = msg.get("Name", "")
+        message_id = msg.get("MessageID")
+        if (message_id is None) or (not name.endswith("Res")):
+            return
+        message_id = str(message_id)
+        self.metrics.response_received(message_id)
+        with self.response_lock:
+            future = self.pending_responses.pop(message_id, None)
+            if future is None:
+                return
+            self.completed_responses[message_id] = future
+            if len(self.completed_responses) > RESPONSE_HISTORY_SIZE:
+                self.completed_responses.popitem(last=False)
+        self.papero_settle_response(message_id, future, msg)
+
+    def papero_fail_response(self, message_id, exc):
+        """
+        応答待ちFutureを1つ異常終了させる
+        @param message_id:MessageID(Noneなら何もしない)
+        @param exc:設定する例外
+        """
+        if message_id is None:
+            return
+        message_id = str(message_id)
+        with self.response_lock:
+            future = self.pending_responses.pop(message_id, None)
+            if future is None:
+                return
+            # 後からpapero_wait_response()した場合も例外を返す
+            self.completed_responses[message_id] = future
+            if len(self.completed_responses) > RESPONSE_HISTORY_SIZE:
+                self.completed_responses.popitem(last=False)
+        self.papero_settle_response(message_id, future, exc=exc)
+
+    def papero_fail_responses(self, exc):
+        """
+        応答待ちFutureをすべて異常終了させる
+        @param exc:設定する例外
+        """
+        with self.response_lock:
+            futures = list(self.pending_responses.items())
+            self.pending_responses.clear()
+        for message_id, future in futures:
+            self.papero_settle_response(message_id, future, exc=exc)
+
+    def papero_settle_response(self, message_id, future, msg=None, exc=None):
+        """
+        応答待ちFutureに結果を設定する(呼び出し側がキャンセルしたFutureには設定しない)
+        @param msg:応答伝文
+        @param exc:異常終了させる場合の例外
+        """
+        # 実行中にするとこれ以降はキャンセルできない
+        if (not future.done()) and future.set_running_or_notify_cancel():
+            if exc is None:
+                future.set_result(msg)
+            else:
+                future.set_exception(exc)
+        # 呼び出し側がFutureをキャンセルしても発話の完了は応答で判断する
+        if message_id in self.speech_pending:
+            self.papero_speech_finished(message_id)
+
+    def papero_wait_response(self, message_id, t):
+        """
+        応答(*Res)受信待ち
+        @param message_id:send_*が返したmessageID
+        @param t:タイムアウト(Noneの場合は受信できるまでブロック)
+        @return 応答伝文(辞書)、t秒以内に受信できなかった場合はNone
+        """
+        try:
+            return self.papero_response_future(message_id).result(timeout=t)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError, ConnectionError,
+                papero_scheduler.CommandSuperseded):
+            return None
+
+    @property
+    def remain_speech_count(self):
+        """
+        完了していない発話の数(Ver.1.01互換)
+        """
+        return len(self.speech_pending)
+
+    def papero_track_speech(self, message_id):
+        """
+        発話の完了待ちに登録(応答の受信又は失敗で完了とする)
+        @param message_id:startSpeechのMessageID
+        """
+        with self.speech_lock:
+            self.speech_pending.add(message_id)
+
+    def papero_speech_finished(self, message_id):
+        with self.speech_lock:
+            self.speech_pending.discard(message_id)
+            self.speech_lock.notify_all()
+
+    def wait_speech_done(self, message_id, timeout=None):
+        """
+        発話の完了待ち
+        @param message_id:send_start_speechが返したmessageID
+        @param timeout:タイムアウト(Noneの場合は完了するまでブロック)
+        @return 完了した場合True、タイムアウト又は切断された場合False
+        """
+        return self.papero_wait_response(message_id, timeout) is not None
+
+    def all_speech_done(self, timeout=None):
+        """
+        送信済みのすべての発話の完了待ち(切断された発話は完了扱い)
+        @param timeout:タイムアウト(Noneの場合は完了するまでブロック)
+        @return 完了した場合True、タイムアウトした場合False
+        """
+        with self.speech_lock:
+            return self.speech_lock.wait_for(lambda: len(self.speech_pending) == 0, timeout)
+
     def papero_recv(self, t):
         """
         伝文受信
@@ -1338,15 +2100,19 @@ class Papero:
         @param t:タイムアウト
         @return 受信伝文の配列、t秒以内に受信できなかった場合はNone
         """
-        robot_message = self.papero_recv(t)
+        return self.papero_handle_robot_message(self.papero_recv(t))
+
+    def papero_handle_robot_message(self, robot_message):
+        """
+        受信伝文からロボット伝文を取り出す
+        @param robot_message:受信伝文
+        @return 受信伝文の配列、ロボット伝文でない場合はNone
+        """
         messages = None
         if robot_message is not None:
-            msg_dic_rcv = json.loads(robot_message)
+            msg_dic_rcv = decode_message(robot_message)
             if msg_dic_rcv["Name"] == "RobotMessage":
                 messages = msg_dic_rcv["Messages"]
-                # Ver.1.01 発話コマンド個数管理
-                if messages[0]["Name"] == "startSpeechRes":
-                    self.remain_speech_count -= 1
             elif msg_dic_rcv["Name"] == "RobotEnd":
                 self.errOccurred = 3
                 self.errDetail = "ScriptEnd"
@@ -1358,6 +2124,8 @@ class Papero:
         """
         終了処理
         """
+        self.papero_flush_batch()
+        self.papero_stop_scheduler()
         if self.errOccurred == 0:
             self.send_script_end()
         self.papero_send(None)
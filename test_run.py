@@ -1,37 +1,104 @@
+import os
 import sys
 
-import pypapero
+import papero_pool
+import papero_metrics
+import papero_lum
 
 import operation
 
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
-papero = pypapero.Papero("iwl2kro4", "", "")
+DEFAULT_SIMULATOR_ID = "iwl2kro4"
+
+# PAPERO_WSSVR でWebSocket接続先を変更できる(ベンチマーク用モックサーバ等)
+pool = papero_pool.PaperoPool(ws_server_addr=os.environ.get("PAPERO_WSSVR", ""))
+lum_samplers = papero_lum.LumSamplers(pool)
+
+
+def robot_key():
+    """
+    リクエストで指定されたシミュレータID・ロボット名(sim/robot)
+    """
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        params = {}
+    simulator_id = params.get("sim") or request.args.get("sim", DEFAULT_SIMULATOR_ID)
+    robot_name = params.get("robot") or request.args.get("robot", "")
+    return simulator_id, robot_name
+
+
+def end_session(result):
+    """
+    bye・終了処理をバックグラウンドで開始し、終了処理ハンドルを返す
+    """
+    handle = pool.end(*robot_key(), before=operation.bye)
+    if handle is None:
+        return jsonify(result=result, teardown=None)
+    return jsonify(result=result, teardown=handle.to_dict()), 202
+
+
+@app.errorhandler(papero_pool.PaperoPoolFull)
+def pool_full(e):
+    return "too many robot sessions", 503
+
+@app.errorhandler(ConnectionError)
+def connection_failed(e):
+    return "robot connection failed", 502
+
+@app.route('/metrics')
+def metrics():
+    sessions = [((("simulator", key[0]), ("robot", key[1])), papero) for key, papero in pool.sessions()]
+    return papero_metrics.render_prometheus(sessions), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route('/lum')
+def lum():
+    """
+    照度(キャッシュした値、max_age=秒数を指定するとそれより古ければ取得を待つ)
+    """
+    reading = lum_samplers.get(robot_key()).read(request.args.get("max_age", type=float))
+    if reading is None:
+        return "luminance not available", 504
+    return jsonify(reading.to_dict())
 
 @app.route('/start')
 def start():
-    operation.hello(papero)
+    with pool.session(*robot_key()) as papero:
+        operation.hello(papero)
     return "start"
 
 @app.route('/ok')
 def ok():
-    operation.ok(papero)
+    with pool.session(*robot_key()) as papero:
+        operation.ok(papero)
     return "ok"
 
 @app.route('/thank')
 def thank():
-    operation.thank(papero)
+    with pool.session(*robot_key()) as papero:
+        operation.thank(papero)
     return "thank"
 
 @app.route('/end')
 def end():
-    operation.bye(papero)
-    papero.papero_cleanup()
-    return "end"
+    return end_session("end")
+
+@app.route('/teardown/<handle_id>')
+def teardown(handle_id):
+    """
+    終了処理の状態取得(wait=秒数を指定すると完了まで待つ)
+    """
+    handle = pool.teardown.get(handle_id)
+    if handle is None:
+        return "unknown teardown", 404
+    wait = request.args.get("wait", type=float)
+    if wait:
+        handle.wait(min(wait, 30.0))
+    return jsonify(handle.to_dict())
 
 
 
@@ -43,19 +110,14 @@ def test():
     else:
         print("post")
         post_data = request.get_json()
-        if post_data['work'] == "hello":
-            operation.hello(papero)
-            return "start"
-        if post_data['work'] == "thank":
-            operation.thank(papero)
-            return "thank"
-        if post_data['work'] == "sorry":
-            operation.sorry(papero)
-            return "sorry"
         if post_data['work'] == "bye":
-            operation.bye(papero)
-            papero.papero_cleanup()
-            return "bye"
+            return end_session("bye")
+        gesture = operation.GESTURES.get(post_data['work'])
+        if gesture is None:
+            return "unknown work", 400
+        with pool.session(*robot_key()) as papero:
+            gesture.play(papero)
+        return gesture.reply
 
 
         #if request.form['work'] == "hello":